@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the image processing hot paths
+Runs on synthetic pages, so no PDF input or poppler install is needed
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+import numpy as np
+from PIL import Image, ImageDraw, ImageEnhance, ImageFont, ImageOps
+from image_processor import FONT_PATHS, ImageProcessor
+from pdf_processor import PDFProcessor
+
+def make_page(dpi=200, dark=True, bar_ratio=0.25):
+    """Create a synthetic tablet screenshot page: white bars around a board"""
+    width, height = int(8.27 * dpi), int(11.69 * dpi)
+    page = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(page)
+    
+    top = int(height * bar_ratio)
+    bottom = height - top
+    board = (25, 45, 35) if dark else (245, 245, 240)
+    ink = (235, 235, 210) if dark else (20, 20, 20)
+    draw.rectangle([0, top, width, bottom], fill=board)
+    for i in range(40):
+        y = top + 20 + i * (bottom - top - 40) // 40
+        draw.line([(60, y), (width - 60 - (i * 37) % 400, y + 8)], fill=ink, width=3)
+    return page
+
+def loop_crop_rows(img_array, mode='content_detection', brightness_threshold=30, variation_threshold=20, min_height_ratio=0.4, margin=5):
+    """Reference row scan as it was written before vectorization"""
+    height = img_array.shape[0]
+    top_content = 0
+    bottom_content = height
+    
+    if mode == 'content_detection':
+        for y in range(height):
+            if np.std(img_array[y, :]) > variation_threshold:
+                top_content = y
+                break
+        for y in range(height - 1, -1, -1):
+            if np.std(img_array[y, :]) > variation_threshold:
+                bottom_content = y + 1
+                break
+    else:
+        for y in range(height):
+            if np.mean(img_array[y, :]) > brightness_threshold:
+                top_content = max(0, y - margin)
+                break
+        for y in range(height - 1, -1, -1):
+            if np.mean(img_array[y, :]) > brightness_threshold:
+                bottom_content = min(height, y + margin)
+                break
+    
+    min_height = int(height * min_height_ratio)
+    if bottom_content - top_content < min_height:
+        center_y = height // 2
+        top_content = max(0, center_y - min_height // 2)
+        bottom_content = min(height, center_y + min_height // 2)
+    
+    if mode == 'black_bar_removal' and top_content <= 20 and (height - bottom_content) <= 20:
+        return None
+    return top_content, bottom_content
+
+def time_call(func, repeat=5):
+    """Return the best wall-clock time of several runs, in milliseconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+def benchmark_row_scan(dpi=200):
+    """Compare the per-row Python loop with the vectorized row search"""
+    print(f"\nRow scan in smart_crop_content ({dpi} DPI page)")
+    processor = ImageProcessor(dpi=dpi)
+    
+    dark_page = np.array(make_page(dpi).convert('L'))
+    cases = [
+        ('content_detection', 'board page', dark_page),
+        ('black_bar_removal', 'inverted board page', 255 - dark_page),
+        ('content_detection', 'mostly blank page', np.array(make_page(dpi, bar_ratio=0.48).convert('L'))),
+    ]
+    
+    for mode, label, gray in cases:
+        # Check the vectorized search keeps exactly the same rows as the loop
+        expected = loop_crop_rows(gray, mode)
+        found = processor.crop_rows(gray, mode)
+        if found != expected:
+            print(f"[ERROR] {label}: vectorized rows {found} != loop rows {expected}")
+            return False
+        
+        loop_ms = time_call(lambda: loop_crop_rows(gray, mode))
+        vector_ms = time_call(lambda: processor.crop_rows(gray, mode))
+        print(f"  {label:<20} {mode:<18} loop {loop_ms:7.2f} ms   vectorized {vector_ms:7.2f} ms   "
+              f"speedup {loop_ms / vector_ms:5.1f}x")
+    
+    return True
+
+def chained_inversion(image):
+    """Reference inversion as three separate Pillow passes"""
+    inverted = ImageOps.invert(image)
+    enhanced = ImageEnhance.Contrast(inverted).enhance(1.2)
+    return ImageEnhance.Brightness(enhanced).enhance(0.95)
+
+def benchmark_inversion(dpi=200):
+    """Compare the invert/contrast/brightness chain with the fused lookup table"""
+    print(f"\nInversion of a cropped board page ({dpi} DPI page)")
+    processor = ImageProcessor(dpi=dpi)
+    
+    page = make_page(dpi)
+    analysis = processor.analyze_page(page)
+    top, bottom = analysis.inverted_bar_rows
+    cropped = page.crop((0, top, page.width, bottom))
+    
+    expected = np.asarray(chained_inversion(cropped), dtype=np.int16)
+    fused = np.asarray(cropped.point(processor.inversion_lut(analysis.inverted_mean_level) * 3))
+    max_diff = int(np.abs(expected - fused).max())
+    if max_diff > 1:
+        print(f"[ERROR] fused inversion differs from the chain by {max_diff} levels")
+        return False
+    
+    chain_ms = time_call(lambda: chained_inversion(cropped))
+    fused_ms = time_call(lambda: cropped.point(processor.inversion_lut(analysis.inverted_mean_level) * 3))
+    print(f"  chain {chain_ms:7.2f} ms   fused LUT {fused_ms:7.2f} ms   "
+          f"speedup {chain_ms / fused_ms:5.1f}x   max difference {max_diff} level(s)")
+    
+    return True
+
+def drawn_text_overlay(image, filename, page_num, total_pages):
+    """Reference overlay as it was written before font and glyph caching"""
+    img_with_text = image.copy()
+    draw = ImageDraw.Draw(img_with_text)
+    
+    filename_text = os.path.splitext(os.path.basename(filename))[0]
+    page_text = f"Page {page_num}/{total_pages}"
+    
+    font_size = max(12, int(image.height * 0.015))
+    font = None
+    for font_path in FONT_PATHS:
+        if os.path.exists(font_path):
+            font = ImageFont.truetype(font_path, font_size)
+            break
+    if font is None:
+        font = ImageFont.load_default()
+    
+    filename_bbox = draw.textbbox((0, 0), filename_text, font=font)
+    page_bbox = draw.textbbox((0, 0), page_text, font=font)
+    filename_width = filename_bbox[2] - filename_bbox[0]
+    filename_height = filename_bbox[3] - filename_bbox[1]
+    page_width = page_bbox[2] - page_bbox[0]
+    page_height = page_bbox[3] - page_bbox[1]
+    
+    x_filename = image.width - filename_width - 20
+    y_filename = image.height - filename_height - page_height - 20 - 5
+    x_page = image.width - page_width - 20
+    y_page = image.height - page_height - 20
+    
+    draw.rectangle([x_filename - 5, y_filename - 5, x_filename + filename_width + 5, y_filename + filename_height + 5],
+                   fill=(255, 255, 255, 200))
+    draw.rectangle([x_page - 5, y_page - 5, x_page + page_width + 5, y_page + page_height + 5],
+                   fill=(255, 255, 255, 200))
+    draw.text((x_filename, y_filename), filename_text, font=font, fill=(0, 0, 0))
+    draw.text((x_page, y_page), page_text, font=font, fill=(0, 0, 0))
+    return img_with_text
+
+def benchmark_overlay(dpi=200):
+    """Compare drawing the overlay text per page with the cached stamps and glyph atlas"""
+    print(f"\nText overlay ({dpi} DPI page)")
+    processor = ImageProcessor(dpi=dpi)
+    page = make_page(dpi)
+    
+    # Check the cached drawing gives exactly the same pixels
+    for page_num, total_pages in [(1, 9), (7, 384), (118, 384), (1000, 1234)]:
+        expected = np.asarray(drawn_text_overlay(page, 'lecture_12_processed.pdf', page_num, total_pages))
+        cached = np.asarray(processor.add_text_overlay(page, 'lecture_12_processed.pdf', page_num, total_pages))
+        in_place = processor.add_text_overlay(page.copy(), 'lecture_12_processed.pdf', page_num, total_pages,
+                                              in_place=True)
+        if not np.array_equal(expected, cached) or not np.array_equal(expected, np.asarray(in_place)):
+            print(f"[ERROR] cached overlay differs from drawn overlay on page {page_num}/{total_pages}")
+            return False
+    
+    counter = iter(range(10**9))
+    page_copy = page.copy()
+    drawn_ms = time_call(lambda: drawn_text_overlay(page, 'lecture_12_processed.pdf', next(counter) % 400 + 1, 400))
+    cached_ms = time_call(lambda: processor.add_text_overlay(page, 'lecture_12_processed.pdf', next(counter) % 400 + 1, 400))
+    # Footers pile up on page_copy, which costs the same as drawing on fresh pages
+    in_place_ms = time_call(lambda: processor.add_text_overlay(page_copy, 'lecture_12_processed.pdf',
+                                                               next(counter) % 400 + 1, 400, in_place=True))
+    print(f"  drawn {drawn_ms:7.2f} ms   cached {cached_ms:7.2f} ms   speedup {drawn_ms / cached_ms:5.1f}x")
+    print(f"  in place {in_place_ms:7.2f} ms   speedup {drawn_ms / in_place_ms:5.1f}x")
+    
+    return True
+
+def benchmark_page_workers(jobs, pages=None, dpi=200):
+    """Compare per-page work throughput on a process pool and a thread pool"""
+    pages = pages or 4 * jobs
+    print(f"\nPage workers: {pages} pages at {dpi} DPI, {jobs} jobs")
+    
+    # Two thirds board pages to invert, one third light pages left as is
+    sources = [make_page(dpi), make_page(dpi), make_page(dpi, dark=False)]
+    
+    outputs = {}
+    runs = [('sequential', 1, False), ('processes', jobs, False), ('threads', jobs, True)]
+    for label, page_jobs, page_threads in runs:
+        processor = PDFProcessor(quality=dpi, page_jobs=page_jobs, page_threads=page_threads)
+        images = (sources[i % len(sources)] for i in range(pages))
+        
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = [
+                np.asarray(page)
+                for page in processor.iter_processed_pages(images, 'benchmark.pdf', pages)
+            ]
+        elapsed = time.perf_counter() - start
+        
+        outputs[label] = results
+        print(f"  {label:<11} {page_jobs:3d} worker(s)   {elapsed:7.2f} s   {pages / elapsed:6.2f} pages/s")
+    
+    # Every mode must produce exactly the same pages
+    for label in ('processes', 'threads'):
+        if not all(np.array_equal(a, b) for a, b in zip(outputs['sequential'], outputs[label])):
+            print(f"[ERROR] {label} output differs from sequential output")
+            return False
+    
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for print-friendly")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="Page workers for the pool comparison (default: CPU count)")
+    parser.add_argument("--pages", type=int,
+                        help="Pages for the pool comparison (default: 4 per job)")
+    args = parser.parse_args()
+    
+    print("Print Friendly - Micro-benchmarks")
+    print("=" * 40)
+    
+    ok = benchmark_row_scan()
+    ok = benchmark_inversion() and ok
+    ok = benchmark_overlay() and ok
+    ok = benchmark_page_workers(args.jobs, args.pages) and ok
+    
+    if not ok:
+        sys.exit(1)
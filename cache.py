@@ -0,0 +1,225 @@
+"""
+Cache Module
+Reuses earlier output PDFs and processed pages for unchanged inputs and options
+"""
+
+from PIL import Image
+import hashlib
+import json
+import numpy as np
+import os
+import shutil
+import tempfile
+from utils import DEFAULT_FILE_MODE
+
+# Bump when a code change alters the output for the same input and options
+CACHE_FORMAT = 1
+
+def default_cache_dir():
+    """Per-user cache directory, following XDG_CACHE_HOME where set"""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'print-friendly')
+
+def file_digest(path):
+    """SHA-256 of a file's bytes, as hex"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def link_or_copy(source, destination):
+    """Atomically replace destination with a hardlink to source, or a copy across filesystems"""
+    fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(destination)))
+    os.close(fd)
+    try:
+        os.remove(temp_path)
+        try:
+            os.link(source, temp_path)
+        except OSError:
+            shutil.copyfile(source, temp_path)
+            os.chmod(temp_path, DEFAULT_FILE_MODE)
+        os.replace(temp_path, destination)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def unlink_shared(path):
+    """
+    Remove path if it is hardlinked elsewhere (e.g. into the cache)
+    
+    Writers truncate the output file in place, which would also change
+    every other link to it.
+    """
+    try:
+        if os.stat(path).st_nlink > 1:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def cache_key(input_digest, **fields):
+    """Hex key for an input file's hash plus the fields describing what was made of it"""
+    description = json.dumps(
+        dict(fields, format=CACHE_FORMAT, input=input_digest), sort_keys=True
+    )
+    return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+class CacheDirectory:
+    """
+    Directory of cache entry files with a size limit
+    
+    Reading an entry refreshes its mtime, and evict() removes the least
+    recently used entries once the directory grows past max_bytes.
+    """
+    
+    def __init__(self, path, max_bytes, suffix):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+    
+    def entry_path(self, key):
+        return os.path.join(self.path, key + self.suffix)
+    
+    def touch(self, key):
+        """Mark an entry as recently used; raises FileNotFoundError if it is gone"""
+        os.utime(self.entry_path(key))
+    
+    def evict(self):
+        """
+        Remove least recently used entries until the directory fits max_bytes
+        
+        Returns the bytes left in the directory.
+        """
+        if not os.path.isdir(self.path):
+            return 0
+        
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        return total
+
+class OutputCache(CacheDirectory):
+    """
+    Content-addressed store of finished output PDFs
+    
+    Entries are keyed by the input file's hash plus every option that
+    affects the output, and handed out as hardlinks where possible.
+    """
+    
+    def __init__(self, cache_dir, max_bytes):
+        super().__init__(os.path.join(cache_dir, 'outputs'), max_bytes, '.pdf')
+    
+    def key(self, input_digest, options):
+        """Cache key for processing an input with the given output options"""
+        return cache_key(input_digest, options=options)
+    
+    def fetch(self, key, output_path):
+        """Place the cached output for key at output_path; returns False on a miss"""
+        try:
+            self.touch(key)
+            link_or_copy(self.entry_path(key), output_path)
+        except FileNotFoundError:
+            return False
+        return True
+    
+    def store(self, key, output_path):
+        """Add a freshly written output to the cache, then evict old entries"""
+        os.makedirs(self.path, exist_ok=True)
+        link_or_copy(output_path, self.entry_path(key))
+        self.evict()
+
+class PageCache(CacheDirectory):
+    """
+    Store of processed (post-inversion) page images
+    
+    Pages are kept as uncompressed NumPy archives, which load with a plain
+    read, so a re-run that only changes layout or overlays skips rendering
+    and inversion. Entries are keyed by the input hash, page number and the
+    settings that affect inversion.
+    
+    The size limit is kept while pages are stored, not only once a file is
+    done: store() counts the bytes it adds and evicts as soon as the count
+    passes max_bytes. Other processes storing into the same directory are
+    caught up with by a fresh scan after every RESCAN_FRACTION of max_bytes.
+    """
+    RESCAN_FRACTION = 1 / 8
+    
+    def __init__(self, cache_dir, max_bytes):
+        super().__init__(os.path.join(cache_dir, 'pages'), max_bytes, '.npz')
+        # Directory size as of the last scan plus the bytes stored since,
+        # None until the first store
+        self._size = None
+        self._stored_since_scan = 0
+    
+    def key(self, input_digest, page_number, options):
+        """Cache key for one processed page of an input"""
+        return cache_key(input_digest, page=page_number, options=options)
+    
+    def contains(self, key):
+        return os.path.exists(self.entry_path(key))
+    
+    def load(self, key):
+        """Return the cached page image, or None if the entry is gone"""
+        try:
+            self.touch(key)
+            with np.load(self.entry_path(key)) as entry:
+                image = Image.fromarray(entry['pixels'])
+                dpi = entry['dpi']
+        except (OSError, ValueError, KeyError):
+            return None
+        
+        if dpi.size:
+            image.info['dpi'] = tuple(float(d) for d in dpi)
+        return image
+    
+    def store(self, key, image):
+        """
+        Save a processed page; safe to call from several processes
+        
+        Caching is best effort: on failure (e.g. a full disk) the page is
+        simply not cached and False is returned.
+        """
+        temp_path = None
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+            with os.fdopen(fd, 'wb') as file:
+                dpi = np.array(image.info.get('dpi', ()), dtype=float)
+                np.savez(file, pixels=np.asarray(image), dpi=dpi)
+            os.replace(temp_path, self.entry_path(key))
+            self._account(os.path.getsize(self.entry_path(key)))
+            return True
+        except OSError:
+            return False
+        finally:
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+    
+    def _account(self, size):
+        """Count a stored entry and evict once the directory may be over its limit"""
+        if self._size is None:
+            self._size = self.evict()
+            return
+        self._size += size
+        self._stored_since_scan += size
+        if (self._size > self.max_bytes
+                or self._stored_since_scan > self.max_bytes * self.RESCAN_FRACTION):
+            self._size = self.evict()
+            self._stored_since_scan = 0
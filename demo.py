@@ -62,12 +62,20 @@ pip install -r requirements.txt
 2. **Test with sample PDF**: Create or obtain a greenboard PDF file
 3. **Run basic conversion**: `python main.py sample.pdf -o output.pdf`
 4. **Test page combining**: `python main.py sample.pdf -o combined.pdf --combine-pages`
+5. **Benchmark hot paths**: `python benchmark.py`
 
 ## Architecture
 
 - **main.py**: CLI interface and orchestration
 - **pdf_processor.py**: Core PDF processing logic
 - **image_processor.py**: Color inversion and image manipulation
+- **pdf_writer.py**: Streaming page-by-page PDF output
+- **size_budget.py**: Per-page encoder settings that keep outputs under --max-output-size
+- **pdf_overlay.py**: Vector filename and page number footers
+- **pdf_images.py**: Direct decoding of embedded screenshot images
+- **page_buffers.py**: Shared memory page slots for worker processes
+- **cache.py**: Content-addressed caches of finished outputs and processed pages
+- **incremental.py**: Page fingerprints and manifests for incremental re-runs
 - **utils.py**: File validation and error handling utilities
 
 ## Success Criteria Met
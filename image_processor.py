@@ -3,72 +3,293 @@ Image Processing Module
 Handles color inversion and image manipulation operations
 """
 
-from PIL import Image, ImageOps, ImageEnhance, ImageDraw, ImageFont
+from PIL import Image, ImageChops, ImageDraw, ImageFilter, ImageFont
 import math
 import numpy as np
 import os
 
+class PageAnalysis:
+    """
+    Grayscale analysis of one page, shared by the steps of invert_colors
+    
+    The luminance array is computed once; the lecture area, dark fraction
+    and post-inversion bar rows are all derived from it. The inverted
+    page's luminance is taken as 255 minus the original luminance.
+    """
+    
+    def __init__(self, processor, image):
+        self.processor = processor
+        gray = image if image.mode == 'L' else image.convert('L')
+        self.luminance = np.asarray(gray)
+        self._content_rows = None
+        self._dark_fraction = None
+        self._inverted_bar_rows = False  # None is a valid result
+    
+    @property
+    def content_rows(self):
+        """(top, bottom) rows of the lecture area, excluding white bars"""
+        if self._content_rows is None:
+            self._content_rows = self.processor.crop_rows(self.luminance, mode='content_detection')
+        return self._content_rows
+    
+    @property
+    def dark_fraction(self):
+        """Fraction of lecture area pixels below 128"""
+        if self._dark_fraction is None:
+            top, bottom = self.content_rows
+            lecture_area = self.luminance[top:bottom]
+            if lecture_area.size:
+                self._dark_fraction = np.count_nonzero(lecture_area < 128) / lecture_area.size
+            else:
+                self._dark_fraction = 0.0
+        return self._dark_fraction
+    
+    @property
+    def inverted_bar_rows(self):
+        """(top, bottom) rows to keep after inversion, or None to keep all"""
+        if self._inverted_bar_rows is False:
+            self._inverted_bar_rows = self.processor.crop_rows(
+                self.luminance, mode='black_bar_removal', inverted=True
+            )
+        return self._inverted_bar_rows
+    
+    @property
+    def inverted_mean_level(self):
+        """Mean grey level of the cropped page after inversion, rounded like ImageEnhance.Contrast"""
+        rows = self.inverted_bar_rows
+        kept = self.luminance if rows is None else self.luminance[rows[0]:rows[1]]
+        if not kept.size:
+            return 0
+        return int(255 - kept.mean() + 0.5)
+
+# Overlay fonts to try, in order
+FONT_PATHS = [
+    "C:/Windows/Fonts/arial.ttf",
+    "C:/Windows/Fonts/calibri.ttf", 
+    "/System/Library/Fonts/Arial.ttf",  # macOS
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"  # Linux
+]
+
+class TextStamp:
+    """
+    A string rendered once into a mask, for pasting onto many pages
+    
+    Drawing it matches ImageDraw.text at an integer position exactly;
+    bbox is what ImageDraw.textbbox((0, 0), text) would return.
+    """
+    
+    def __init__(self, font, text):
+        self.bbox = ImageDraw.Draw(Image.new('L', (1, 1))).textbbox((0, 0), text, font=font)
+        # Render with a margin so the mask's origin is simply (-margin, -margin)
+        self._margin = 2 + max(0, -self.bbox[0], -self.bbox[1])
+        width = self.bbox[2] + 2 * self._margin
+        height = self.bbox[3] + 2 * self._margin
+        self.mask = Image.new('L', (max(1, width), max(1, height)), 0)
+        ImageDraw.Draw(self.mask).text((self._margin, self._margin), text, font=font, fill=255)
+    
+    def draw(self, image, xy, fill):
+        image.paste(fill, (xy[0] - self._margin, xy[1] - self._margin), self.mask)
+
+class PageNumberAtlas:
+    """
+    Pre-rendered glyphs for drawing "Page N/M" labels in one font
+    
+    "Page " is one stamp and each digit and "/" is rendered once per
+    subpixel start offset, as FreeType places it, so a label is a few
+    small pastes and matches ImageDraw.text exactly. Fonts that kern
+    between these glyphs can't be composed this way (supported is False).
+    """
+    PREFIX = "Page "
+    GLYPHS = "0123456789/"
+    
+    def __init__(self, font):
+        self.font = font
+        self.prefix = TextStamp(font, self.PREFIX)
+        self.prefix_advance = font.getlength(self.PREFIX)
+        self.advances = {glyph: font.getlength(glyph) for glyph in self.GLYPHS}
+        self._glyphs = {}
+        self.supported = all(
+            font.getlength(first + second) == self.advances[first] + self.advances[second]
+            for first in self.GLYPHS for second in self.GLYPHS
+        ) and all(
+            font.getlength(self.PREFIX + glyph) == self.prefix_advance + self.advances[glyph]
+            for glyph in self.GLYPHS
+        )
+    
+    def _glyph(self, glyph, start):
+        """
+        A glyph drawn at pen position start (0 <= start < 1)
+        
+        Returns (mask, margin, bbox): the mask is offset by margin pixels,
+        bbox is the glyph's box relative to the integer pen position.
+        """
+        key = (glyph, start)
+        if key not in self._glyphs:
+            bitmap, offset = self.font.getmask2(glyph, 'L', start=(start, 0))
+            bbox = (offset[0], offset[1], offset[0] + bitmap.size[0], offset[1] + bitmap.size[1])
+            margin = 2 + max(0, -bbox[0], -bbox[1])
+            mask = Image.new('L', (bbox[2] + 2 * margin, bbox[3] + 2 * margin), 0)
+            ImageDraw.Draw(mask).text((margin + start, margin), glyph, font=self.font, fill=255)
+            self._glyphs[key] = (mask, margin, bbox)
+        return self._glyphs[key]
+    
+    def _layout(self, page_text):
+        """Pen positions of the characters after the prefix"""
+        x = self.prefix_advance
+        for glyph in page_text[len(self.PREFIX):]:
+            yield glyph, x
+            x += self.advances[glyph]
+    
+    def bbox(self, page_text):
+        """Same as ImageDraw.textbbox((0, 0), page_text)"""
+        left, top, right, bottom = self.prefix.bbox
+        for glyph, x in self._layout(page_text):
+            box = self._glyph(glyph, x % 1)[2]
+            left = min(left, int(x) + box[0])
+            top = min(top, box[1])
+            right = max(right, int(x) + box[2])
+            bottom = max(bottom, box[3])
+        return left, top, right, bottom
+    
+    def draw(self, image, xy, page_text, fill):
+        self.prefix.draw(image, xy, fill)
+        for glyph, x in self._layout(page_text):
+            mask, margin, _ = self._glyph(glyph, x % 1)
+            image.paste(fill, (xy[0] + int(x) - margin, xy[1] - margin), mask)
+
 class ImageProcessor:
-    def __init__(self, dpi=200):
+    # Output page color modes: keep RGB, always grayscale, grayscale for
+    # pages without visible color, or black and white (1 bit per pixel)
+    COLOR_MODES = ('rgb', 'gray', 'auto', 'bilevel')
+    # Bilevel thresholds: one level per page (Otsu's method), or per pixel
+    # from the mean of its neighborhood
+    THRESHOLDS = ('global', 'adaptive')
+    # Background flattening: levels less than this many half widths of the
+    # background peak below it are noise on the background and become white,
+    # over a ramp of this many levels from the unchanged darker ones
+    FLATTEN_SPREAD = 3
+    FLATTEN_RAMP = 48
+    # Despeckling: ink pixels with no more than this many ink pixels (their
+    # own included) within this radius are specks
+    SPECK_RADIUS = 3
+    SPECK_MAX_PIXELS = 9
+    
+    def __init__(self, dpi=200, color_mode='rgb', threshold='global', flatten_background=False,
+                 despeckle=False):
+        if color_mode not in self.COLOR_MODES:
+            raise ValueError(f"Unknown color mode: {color_mode}")
+        if threshold not in self.THRESHOLDS:
+            raise ValueError(f"Unknown threshold: {threshold}")
         # A4 dimensions in inches: 8.27 x 11.69
         self.dpi = dpi
+        self.color_mode = color_mode
+        self.threshold = threshold
+        # Turn the former board background of inverted pages pure white,
+        # and optionally remove the specks left on it (implies flattening)
+        self.flatten_background = flatten_background or despeckle
+        self.despeckle = despeckle
         self.a4_width = int(8.27 * dpi)   # A4 width at specified DPI
         self.a4_height = int(11.69 * dpi)  # A4 height at specified DPI
+        self._lut_cache = {}
+        # Overlay fonts by size, filename stamps and page number atlases
+        self._fonts = {}
+        self._text_stamps = {}
+        self._page_atlases = {}
     
-    def smart_crop_content(self, image, mode='content_detection', brightness_threshold=30, variation_threshold=20, min_height_ratio=0.4, margin=5):
+    def __getstate__(self):
+        # FreeType fonts can't be pickled; worker processes build their own
+        state = self.__dict__.copy()
+        state['_fonts'] = {}
+        state['_text_stamps'] = {}
+        state['_page_atlases'] = {}
+        return state
+    
+    @staticmethod
+    def _rows_above_std(rows, threshold):
         """
-        Unified cropping function that can handle both content detection and black bar removal
+        Vectorized `np.std(row) > threshold` for every row of a 2D uint8 block
         
-        Args:
-            image: PIL Image to crop
-            mode: 'content_detection' (for lecture area) or 'black_bar_removal' (post-inversion)
-            brightness_threshold: For black bar removal - pixels brighter than this are content
-            variation_threshold: For content detection - std dev above this indicates content
-            min_height_ratio: Minimum height to preserve as ratio of original
-            margin: Pixels to add around detected content
+        n^2 * variance is computed exactly from integer row sums; rows that
+        land on the threshold are re-checked with np.std so results match it.
+        """
+        n = rows.shape[1]
+        values = rows.astype(np.float64)
+        sums = values.sum(axis=1)
+        spread = n * np.einsum('ij,ij->i', values, values) - sums * sums
+        limit = float(threshold) * threshold * n * n
+        
+        result = spread > limit
+        for y in np.flatnonzero(np.abs(spread - limit) <= limit * 1e-9 + 1e-9):
+            result[y] = np.std(rows[y]) > threshold
+        return result
+    
+    @staticmethod
+    def _rows_above_mean(rows, threshold):
+        """Vectorized `np.mean(row) > threshold` for every row of a 2D uint8 block"""
+        # Integer sums are exact in float64, so this is the same division np.mean does
+        return rows.sum(axis=1, dtype=np.float64) / rows.shape[1] > threshold
+    
+    @staticmethod
+    def _first_last_rows(img_array, row_test, block_rows=64):
+        """
+        Find the first and last rows for which row_test is True
         
-        Returns:
-            Crop box tuple (left, top, right, bottom) or cropped image based on context
+        Rows are tested a block at a time from each end, stopping at the first
+        block with a hit, so uniform bars cost a few vectorized passes.
+        Returns (first, last) row indices, or None if no row qualifies.
         """
-        # Convert to grayscale for analysis
-        if image.mode != 'L':
-            gray = image.convert('L')
-        else:
-            gray = image
+        height = img_array.shape[0]
+        
+        first = None
+        for y in range(0, height, block_rows):
+            hits = np.flatnonzero(row_test(img_array[y:y + block_rows]))
+            if hits.size:
+                first = y + int(hits[0])
+                break
+        if first is None:
+            return None
+        
+        for y in range(height, first, -block_rows):
+            start = max(first, y - block_rows)
+            hits = np.flatnonzero(row_test(img_array[start:y]))
+            if hits.size:
+                return first, start + int(hits[-1])
+        return first, first
+    
+    def crop_rows(self, img_array, mode='content_detection', brightness_threshold=30, variation_threshold=20, min_height_ratio=0.4, margin=5, inverted=False):
+        """
+        Find the rows to keep for smart_crop_content on a grayscale array
         
-        img_array = np.array(gray)
-        height, width = img_array.shape
+        With inverted=True the array is analysed as if it were 255 - array,
+        one block at a time, without materializing the inverted page.
+        
+        Returns (top, bottom) rows, or None in 'black_bar_removal' mode when
+        no significant bars were found and the image should be left as is.
+        """
+        height = img_array.shape[0]
         
         top_content = 0
         bottom_content = height
         
         if mode == 'content_detection':
             # Use standard deviation to find content vs uniform areas (white bars)
-            for y in range(height):
-                row = img_array[y, :]
-                if np.std(row) > variation_threshold:
-                    top_content = y
-                    break
-            
-            for y in range(height - 1, -1, -1):
-                row = img_array[y, :]
-                if np.std(row) > variation_threshold:
-                    bottom_content = y + 1
-                    break
+            # Standard deviation is unchanged by inversion
+            rows = self._first_last_rows(
+                img_array, lambda block: self._rows_above_std(block, variation_threshold)
+            )
+            if rows is not None:
+                top_content = rows[0]
+                bottom_content = rows[1] + 1
                     
         elif mode == 'black_bar_removal':
             # Use mean brightness to find content vs dark areas (black bars)
-            for y in range(height):
-                row_avg = np.mean(img_array[y, :])
-                if row_avg > brightness_threshold:
-                    top_content = max(0, y - margin)
-                    break
-            
-            for y in range(height - 1, -1, -1):
-                row_avg = np.mean(img_array[y, :])
-                if row_avg > brightness_threshold:
-                    bottom_content = min(height, y + margin)
-                    break
+            rows = self._first_last_rows(
+                img_array,
+                lambda block: self._rows_above_mean(255 - block if inverted else block, brightness_threshold)
+            )
+            if rows is not None:
+                top_content = max(0, rows[0] - margin)
+                bottom_content = min(height, rows[1] + margin)
         
         # Ensure minimum height preservation
         min_height = int(height * min_height_ratio)
@@ -81,67 +302,312 @@ class ImageProcessor:
         
         # For black bar removal, only crop if significant bars found (20+ pixels)
         if mode == 'black_bar_removal' and top_content <= 20 and (height - bottom_content) <= 20:
+            return None
+        
+        return top_content, bottom_content
+    
+    def smart_crop_content(self, image, mode='content_detection', brightness_threshold=30, variation_threshold=20, min_height_ratio=0.4, margin=5):
+        """
+        Unified cropping function that can handle both content detection and black bar removal
+        
+        Args:
+            image: PIL Image to crop
+            mode: 'content_detection' (for lecture area) or 'black_bar_removal' (post-inversion)
+            brightness_threshold: For black bar removal - pixels brighter than this are content
+            variation_threshold: For content detection - std dev above this indicates content
+            min_height_ratio: Minimum height to preserve as ratio of original
+            margin: Pixels to add around detected content
+        
+        Returns:
+            Crop box tuple (left, top, right, bottom) or cropped image based on context
+        """
+        # Convert to grayscale for analysis
+        if image.mode != 'L':
+            gray = image.convert('L')
+        else:
+            gray = image
+        
+        img_array = np.asarray(gray)
+        rows = self.crop_rows(
+            img_array, mode, brightness_threshold, variation_threshold, min_height_ratio, margin
+        )
+        
+        if rows is None:
             return image  # Return original if no significant bars found
         
         # Return cropped image
-        return image.crop((0, top_content, width, bottom_content))
+        return image.crop((0, rows[0], image.width, rows[1]))
 
-    def is_image_dark(self, image, threshold=0.7):
+    def inversion_lut(self, pivot, contrast=1.2, brightness=0.95):
         """
-        Check if image is dark enough to warrant color inversion
-        Returns True if a portion of the lecture area is dark (determined by threshold)
+        Build the 256-entry table for inversion followed by contrast and brightness
+        
+        Equivalent to ImageOps.invert, then ImageEnhance.Contrast(contrast)
+        around the grey level `pivot`, then ImageEnhance.Brightness(brightness).
+        The arithmetic mirrors Pillow's blend (float32, clipped, truncated).
         """
-        lecture_area = self.smart_crop_content(image, mode='content_detection')
+        key = (pivot, contrast, brightness)
+        if key not in self._lut_cache:
+            levels = 255 - np.arange(256, dtype=np.float32)
+            
+            pivot = np.float32(pivot)
+            enhanced = pivot + np.float32(contrast) * (levels - pivot)
+            enhanced = np.clip(enhanced, 0, 255).astype(np.uint8)
+            
+            result = (np.float32(brightness) * enhanced.astype(np.float32)).astype(np.uint8)
+            self._lut_cache[key] = result.tolist()
         
-        # Convert to grayscale for analysis
-        if lecture_area.mode != 'L':
-            gray = lecture_area.convert('L')
-        else:
-            gray = lecture_area
+        return self._lut_cache[key]
+    
+    def white_point(self, histogram):
+        """
+        Level from which one band of an inverted page counts as background
         
-        # Convert to numpy array
-        img_array = np.array(gray)
+        The background is the tallest (lightly smoothed) peak above the
+        Otsu split between ink and background; its noise is judged from the
+        peak's half width at half maximum on the darker side.
+        """
+        counts = np.asarray(histogram, dtype=np.float64)
+        split = self.otsu_threshold(counts)
+        # Contrast stretching leaves empty levels between filled ones
+        smooth = np.convolve(counts, np.ones(5) / 5, mode='same')
+        peak = split + 1 + int(np.argmax(smooth[split + 1:]))
+        darker = np.flatnonzero(smooth[:peak] < smooth[peak] / 2)
+        half_width = peak - darker[-1] if darker.size else peak
+        return max(split + 1, int(peak - self.FLATTEN_SPREAD * half_width))
+    
+    def flatten_lut(self, lut, histogram):
+        """
+        Extend an inversion table so it also turns the page background white
+        
+        histogram is the page's before inversion (one 256-entry block per
+        band); mapped through lut it gives the inverted page's, so each band
+        gets its own white point without another pass over the pixels.
+        Levels from the white point up become 255, and a ramp below it
+        blends into the unchanged darker levels. Returns one table per band,
+        concatenated as Image.point expects.
+        """
+        table = np.asarray(lut)
+        levels = np.arange(256, dtype=np.float32)
+        result = []
+        for band in range(len(histogram) // 256):
+            counts = np.bincount(table, weights=histogram[band * 256:(band + 1) * 256], minlength=256)
+            white = self.white_point(counts)
+            knee = max(0, white - self.FLATTEN_RAMP)
+            ramp = knee + (levels - knee) * (255 - knee) / max(1, white - knee)
+            stretch = np.clip(np.where(levels < knee, levels, ramp), 0, 255).astype(np.uint8)
+            result += stretch[table].tolist()
+        return result
+    
+    def remove_specks(self, image):
+        """
+        Whiten isolated specks (chalk dust, compression noise) on a flattened page, in place
         
-        # Calculate percentage of dark pixels (below 128 on 0-255 scale)
-        dark_pixels = np.sum(img_array < 128)
-        total_pixels = img_array.size
-        dark_percentage = dark_pixels / total_pixels
+        A speck is a non-white pixel with at most SPECK_MAX_PIXELS non-white
+        pixels within SPECK_RADIUS, so small clusters on clear background
+        go while strokes, dots and stroke ends keep their neighbors. The
+        counts come from one box blur of the ink mask.
+        """
+        gray = image if image.mode == 'L' else image.convert('L')
+        ink = gray.point([255] * 255 + [0])
+        box = (2 * self.SPECK_RADIUS + 1) ** 2
+        crowd = ink.filter(ImageFilter.BoxBlur(self.SPECK_RADIUS))
+        # The blur averages 255 per ink pixel over the box, rounded
+        limit = (self.SPECK_MAX_PIXELS * 255 + box // 2) // box
+        lonely = crowd.point([255 if value <= limit else 0 for value in range(256)])
+        image.paste('white', mask=ImageChops.multiply(ink, lonely))
+        return image
+    
+    def analyze_page(self, image):
+        """Compute the shared grayscale analysis for a page"""
+        return PageAnalysis(self, image)
+    
+    def is_image_dark(self, image, threshold=0.7, analysis=None):
+        """
+        Check if image is dark enough to warrant color inversion
+        Returns True if a portion of the lecture area is dark (determined by threshold)
+        """
+        if analysis is None:
+            analysis = self.analyze_page(image)
         
-        return dark_percentage >= threshold
+        return analysis.dark_fraction >= threshold
 
-    def invert_colors(self, image):
+    @staticmethod
+    def _colored_fraction(image, tolerance, step):
+        """Fraction of every step-th pixel (across and down) with visible color"""
+        if step > 1:
+            size = (max(1, image.width // step), max(1, image.height // step))
+            image = image.resize(size, Image.Resampling.NEAREST)
+        red, green, blue = image.split()
+        chroma = ImageChops.lighter(
+            ImageChops.difference(red, green), ImageChops.difference(green, blue)
+        )
+        return sum(chroma.histogram()[tolerance + 1:]) / (image.width * image.height)
+    
+    def is_grayscale(self, image, tolerance=24, max_fraction=0.0001, step=2):
+        """
+        Check whether an RGB page shows no color worth keeping
+        
+        A pixel counts as colored when two of its channels differ by more
+        than tolerance (JPEG noise stays below that); the page is grayscale
+        when at most max_fraction of its pixels are colored. Only every
+        step-th pixel across and down is looked at, which still catches
+        colored pen strokes.
+        """
+        # A coarse sample settles most colored pages cheaply; pages that
+        # look gray there get the full check
+        for sample_step in (4 * step, step):
+            if self._colored_fraction(image, tolerance, sample_step) > max_fraction:
+                return False
+        return True
+    
+    def output_mode(self, image):
+        """
+        Mode ('RGB' or 'L') a page is carried in through the rest of the pipeline
+        
+        Bilevel pages stay grayscale until binarize, after combining, so
+        that resizing works on gray levels rather than on single bits.
+        """
+        if self.color_mode == 'rgb':
+            return 'RGB'
+        if self.color_mode in ('gray', 'bilevel') or image.mode == 'L':
+            return 'L'
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return 'L' if self.is_grayscale(image) else 'RGB'
+    
+    def invert_colors(self, image, analysis=None, is_dark=None):
         """
         Invert image colors with enhanced processing for greenboard notes
         Only performs inversion if 70% or more of the image is dark
+        
+        is_dark can pass in a decision made elsewhere (e.g. from a preview
+        render) to skip darkness detection on this image. Pages come out as
+        RGB, or as grayscale (mode 'L') where color_mode allows, which the
+        later steps keep so that they handle one channel instead of three.
+        With flatten_background, inverted pages also get their background
+        made pure white in the same table lookup (see flatten_lut).
         """
         try:
-            # Convert to RGB if not already
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
+            # Convert to the output mode first, so the work below is done
+            # on a single channel for grayscale pages
+            mode = self.output_mode(image)
+            if image.mode != mode:
+                image = image.convert(mode)
             
             # Check if image is dark enough to warrant inversion
-            if not self.is_image_dark(image):
-                return image  # Return original image if not dark enough
+            if is_dark is None:
+                # One grayscale pass serves darkness detection and bar cropping
+                if analysis is None:
+                    analysis = self.analyze_page(image)
+                is_dark = self.is_image_dark(image, analysis=analysis)
             
-            # Basic color inversion
-            inverted = ImageOps.invert(image)
+            if not is_dark:
+                return image  # Return original image if not dark enough
             
-            # Auto-crop black bars that appear after inversion
-            cropped = self.smart_crop_content(inverted, mode='black_bar_removal')
+            if analysis is None:
+                analysis = self.analyze_page(image)
             
-            # Enhance contrast for better readability
-            enhancer = ImageEnhance.Contrast(cropped)
-            enhanced = enhancer.enhance(1.2)  # Increase contrast by 20%
+            # Auto-crop the black bars that appear after inversion; cropping
+            # first means the bars are never inverted at all
+            bar_rows = analysis.inverted_bar_rows
+            if bar_rows is not None:
+                image = image.crop((0, bar_rows[0], image.width, bar_rows[1]))
             
-            # Slightly adjust brightness
-            brightness_enhancer = ImageEnhance.Brightness(enhanced)
-            result = brightness_enhancer.enhance(0.95)  # Slightly reduce brightness
+            # Invert, enhance contrast for better readability and slightly
+            # reduce brightness in one lookup table pass over the page
+            lut = self.inversion_lut(analysis.inverted_mean_level)
+            if self.flatten_background:
+                lut = self.flatten_lut(lut, image.histogram())
+            else:
+                lut = lut * len(image.getbands())
+            image = image.point(lut)
             
-            return result
+            if self.despeckle:
+                image = self.remove_specks(image)
+            return image
             
         except Exception as e:
             raise Exception(f"Failed to invert image colors: {str(e)}")
     
+    @staticmethod
+    def otsu_threshold(histogram):
+        """
+        Gray level that best separates ink from background (Otsu's method)
+        
+        Every candidate level is scored at once from cumulative sums of the
+        256-bin histogram; levels at or below the result count as ink.
+        """
+        counts = np.asarray(histogram, dtype=np.float64)
+        weight = np.cumsum(counts)
+        mass = np.cumsum(counts * np.arange(256))
+        total = weight[-1]
+        if not total:
+            return 127
+        
+        # Between-class variance, up to a constant factor
+        spread = weight * (total - weight)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            variance = np.where(spread > 0, (mass[-1] / total * weight - mass) ** 2 / spread, 0.0)
+        if not variance.any():
+            return 127  # A single gray level, nothing to separate
+        return int(np.argmax(variance))
+    
+    def adaptive_ink(self, gray, window=None, offset=0.15, block_rows=64):
+        """
+        Boolean array marking pixels darker than their neighborhood
+        
+        A pixel is ink when it is more than offset below the mean of the
+        window x window square around it (Bradley-Roth); the window sums come
+        from running sums, a block of rows at a time.
+        """
+        if window is None:
+            # About a quarter of an inch, wider than any pen stroke
+            window = max(3, self.dpi // 4)
+        levels = np.asarray(gray)
+        height, width = levels.shape
+        
+        # Running sums down each column, then across each block of window
+        # rows; window sums of uint8 levels fit comfortably in int32
+        column_sums = np.zeros((height + 1, width), dtype=np.int32)
+        np.cumsum(levels, axis=0, dtype=np.int32, out=column_sums[1:])
+        
+        radius = window // 2
+        x0 = np.clip(np.arange(width) - radius, 0, width)
+        x1 = np.clip(np.arange(width) + radius + 1, 0, width)
+        row_sums = np.zeros((block_rows, width + 1), dtype=np.int32)
+        ink = np.empty((height, width), dtype=bool)
+        for top in range(0, height, block_rows):
+            bottom = min(height, top + block_rows)
+            rows = np.arange(top, bottom)
+            y0 = np.clip(rows - radius, 0, height)
+            y1 = np.clip(rows + radius + 1, 0, height)
+            block_sums = row_sums[:bottom - top]
+            np.cumsum(column_sums[y1] - column_sums[y0], axis=1, out=block_sums[:, 1:])
+            sums = block_sums[:, x1] - block_sums[:, x0]
+            counts = (y1 - y0)[:, None] * (x1 - x0)
+            ink[top:bottom] = levels[top:bottom] * counts < sums * (1 - offset)
+        return ink
+    
+    def binarize(self, image):
+        """
+        Reduce a page to black ink on white (mode '1')
+        
+        Uses one Otsu level for the page with the 'global' threshold, or a
+        level per pixel from its surroundings with 'adaptive', which copes
+        with uneven lighting in photographed boards.
+        """
+        if image.mode != 'L':
+            image = image.convert('L')
+        
+        if self.threshold == 'adaptive':
+            bilevel = Image.fromarray(~self.adaptive_ink(image))
+            bilevel.info.update(image.info)
+            return bilevel
+        
+        level = self.otsu_threshold(image.histogram())
+        return image.point([255 if value > level else 0 for value in range(256)], '1')
+    
     def resize_to_fit(self, image, target_width, target_height, maintain_aspect=True):
         """
         Resize image to fit within target dimensions while maintaining aspect ratio
@@ -167,23 +633,24 @@ class ImageProcessor:
         if len(images) < 2:
             return images
         
-        combined_images = []
+        return list(self.iter_combined_pages(images))
+    
+    def iter_combined_pages(self, images):
+        """
+        Combine pairs of images vertically on A4 pages, one pair at a time
         
-        # Process images in pairs
-        for i in range(0, len(images), 2):
-            if i + 1 < len(images):
-                # Two images to combine
-                img1 = images[i]
-                img2 = images[i + 1]
-            else:
-                # Odd number of images, last one goes alone on A4 page
-                single_img = self.resize_to_fit(images[i], self.a4_width - 80, self.a4_height - 80)
-                a4_canvas = Image.new('RGB', (self.a4_width, self.a4_height), 'white')
-                x = (self.a4_width - single_img.width) // 2
-                y = (self.a4_height - single_img.height) // 2
-                a4_canvas.paste(single_img, (x, y))
-                combined_images.append(a4_canvas)
-                break
+        Accepts any iterable of images and only buffers the first image of
+        the current pair, so it can sit in a streaming pipeline.
+        """
+        pending = None
+        
+        for image in images:
+            if pending is None:
+                pending = image
+                continue
+            
+            img1, img2 = pending, image
+            pending = None
             
             # Calculate available space for each image (with margins)
             margin = 40
@@ -193,9 +660,11 @@ class ImageProcessor:
             # Resize both images to fit their allocated space
             resized_img1 = self.resize_to_fit(img1, available_width, available_height_per_image)
             resized_img2 = self.resize_to_fit(img2, available_width, available_height_per_image)
+            del img1, img2
             
-            # Create A4 canvas with white background
-            a4_canvas = Image.new('RGB', (self.a4_width, self.a4_height), 'white')
+            # Create A4 canvas with white background, grayscale if both pages are
+            mode = 'L' if resized_img1.mode == resized_img2.mode == 'L' else 'RGB'
+            a4_canvas = Image.new(mode, (self.a4_width, self.a4_height), 'white')
             
             # Position first image (top half)
             x1 = (self.a4_width - resized_img1.width) // 2
@@ -207,9 +676,46 @@ class ImageProcessor:
             y2 = margin + available_height_per_image + margin  # Start after first image + margin
             a4_canvas.paste(resized_img2, (x2, y2))
             
-            combined_images.append(a4_canvas)
-        
-        return combined_images
+            yield a4_canvas
+        
+        if pending is not None:
+            # Odd number of images, last one goes alone on A4 page
+            single_img = self.resize_to_fit(pending, self.a4_width - 80, self.a4_height - 80)
+            mode = 'L' if single_img.mode == 'L' else 'RGB'
+            a4_canvas = Image.new(mode, (self.a4_width, self.a4_height), 'white')
+            x = (self.a4_width - single_img.width) // 2
+            y = (self.a4_height - single_img.height) // 2
+            a4_canvas.paste(single_img, (x, y))
+            yield a4_canvas
+    
+    def process_output_page(self, images, dark_flags, filename, page_num, total_pages, combine=False,
+                            page_cache=None, cache_keys=None):
+        """
+        Produce one finished output page from its source page images
+        
+        Inverts each source page, places them on an A4 canvas when combining
+        (one page, or a pair), binarizes it in bilevel mode, and adds the
+        filename and page number overlay.
+        dark_flags holds one precomputed darkness decision (or None) per image.
+        Inverted pages are saved to page_cache under their cache_keys entry,
+        where that is not None. With filename None the overlay is left out.
+        """
+        pages = [
+            self.invert_colors(image, is_dark=is_dark)
+            for image, is_dark in zip(images, dark_flags)
+        ]
+        if page_cache is not None:
+            for page, key in zip(pages, cache_keys):
+                if key is not None:
+                    page_cache.store(key, page)
+        if combine:
+            pages = list(self.iter_combined_pages(pages))
+        if self.color_mode == 'bilevel':
+            pages = [self.binarize(page) for page in pages]
+        
+        if filename is None:
+            return pages[0]
+        return self.add_text_overlay(pages[0], filename, page_num, total_pages, in_place=True)
     
     def optimize_for_printing(self, image):
         """
@@ -222,12 +728,57 @@ class ImageProcessor:
         # Ensure reasonable DPI for printing
         return image
     
-    def add_text_overlay(self, image, filename, page_num, total_pages):
+    def _overlay_font(self, font_size):
+        """Overlay font at a size, loaded once and reused for every page and file"""
+        if font_size not in self._fonts:
+            try:
+                # Try common system fonts
+                font = None
+                for font_path in FONT_PATHS:
+                    if os.path.exists(font_path):
+                        font = ImageFont.truetype(font_path, font_size)
+                        break
+                
+                if font is None:
+                    font = ImageFont.load_default()
+            except:
+                font = ImageFont.load_default()
+            self._fonts[font_size] = font
+        return self._fonts[font_size]
+    
+    def _text_stamp(self, text, font_size):
+        """Pre-rendered and measured overlay text, e.g. a file's name line"""
+        key = (text, font_size)
+        if key not in self._text_stamps:
+            self._text_stamps[key] = TextStamp(self._overlay_font(font_size), text)
+        return self._text_stamps[key]
+    
+    def _page_atlas(self, font_size):
+        """Glyph atlas for page number labels, or None if the font can't use one"""
+        if font_size not in self._page_atlases:
+            font = self._overlay_font(font_size)
+            atlas = None
+            if isinstance(font, ImageFont.FreeTypeFont):
+                atlas = PageNumberAtlas(font)
+                if not atlas.supported:
+                    atlas = None
+            self._page_atlases[font_size] = atlas
+        return self._page_atlases[font_size]
+    
+    def add_text_overlay(self, image, filename, page_num, total_pages, in_place=False):
         """
         Add filename and page number overlay to bottom right of image
+        
+        The font, the rendered filename line and the page number glyphs are
+        cached per font size, so each page only pastes a few small masks.
+        With in_place the caller hands over the image and it is drawn on
+        directly, touching only the footer area instead of copying the page.
         """
-        # Create a copy to avoid modifying original
-        img_with_text = image.copy()
+        if in_place:
+            img_with_text = image
+        else:
+            # Create a copy to avoid modifying original
+            img_with_text = image.copy()
         draw = ImageDraw.Draw(img_with_text)
         
         # Extract just the filename without path and extension
@@ -237,30 +788,17 @@ class ImageProcessor:
         filename_text = f"{base_filename}"
         page_text = f"Page {page_num}/{total_pages}"
         
-        # Try to use a system font, fallback to default
         font_size = max(12, int(image.height * 0.015))  # Scale with image size
-        try:
-            # Try common system fonts
-            font_paths = [
-                "C:/Windows/Fonts/arial.ttf",
-                "C:/Windows/Fonts/calibri.ttf", 
-                "/System/Library/Fonts/Arial.ttf",  # macOS
-                "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"  # Linux
-            ]
-            font = None
-            for font_path in font_paths:
-                if os.path.exists(font_path):
-                    font = ImageFont.truetype(font_path, font_size)
-                    break
-            
-            if font is None:
-                font = ImageFont.load_default()
-        except:
-            font = ImageFont.load_default()
+        filename_stamp = self._text_stamp(filename_text, font_size)
+        page_atlas = self._page_atlas(font_size)
+        if page_atlas is not None:
+            page_bbox = page_atlas.bbox(page_text)
+        else:
+            page_stamp = TextStamp(self._overlay_font(font_size), page_text)
+            page_bbox = page_stamp.bbox
         
         # Calculate text dimensions and positions
-        filename_bbox = draw.textbbox((0, 0), filename_text, font=font)
-        page_bbox = draw.textbbox((0, 0), page_text, font=font)
+        filename_bbox = filename_stamp.bbox
         
         filename_width = filename_bbox[2] - filename_bbox[0]
         filename_height = filename_bbox[3] - filename_bbox[1]
@@ -275,7 +813,7 @@ class ImageProcessor:
         x_page = image.width - page_width - margin
         y_page = image.height - page_height - margin
         
-        # Add semi-transparent background rectangles for better readability
+        # Add background rectangles for better readability
         padding = 5
         
         # Background for filename
@@ -294,12 +832,15 @@ class ImageProcessor:
             y_page + page_height + padding
         ]
         
-        # Draw semi-transparent backgrounds
-        draw.rectangle(filename_bg, fill=(255, 255, 255, 200))
-        draw.rectangle(page_bg, fill=(255, 255, 255, 200))
+        # Draw backgrounds; colors are named so they suit RGB and L pages
+        draw.rectangle(filename_bg, fill='white')
+        draw.rectangle(page_bg, fill='white')
         
         # Draw text
-        draw.text((x_filename, y_filename), filename_text, font=font, fill=(0, 0, 0))
-        draw.text((x_page, y_page), page_text, font=font, fill=(0, 0, 0))
+        filename_stamp.draw(img_with_text, (x_filename, y_filename), 'black')
+        if page_atlas is not None:
+            page_atlas.draw(img_with_text, (x_page, y_page), page_text, 'black')
+        else:
+            page_stamp.draw(img_with_text, (x_page, y_page), 'black')
         
         return img_with_text
\ No newline at end of file
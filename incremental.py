@@ -0,0 +1,124 @@
+"""
+Incremental Processing Module
+Fingerprints input pages so a re-run only processes new or changed pages
+"""
+
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+import hashlib
+import json
+import os
+import tempfile
+from cache import file_digest
+from utils import DEFAULT_FILE_MODE
+
+# Bump when the manifest layout or fingerprint method changes
+MANIFEST_FORMAT = 2
+
+def manifest_path(output_path):
+    """Sidecar file next to the output recording what it was made from"""
+    return os.path.splitext(output_path)[0] + '.manifest.json'
+
+def _hash_object(obj, digest, seen):
+    """Feed a PDF object and everything it references into digest"""
+    if isinstance(obj, IndirectObject):
+        key = (obj.idnum, obj.generation)
+        if key in seen:
+            digest.update(b'R')
+            return
+        seen.add(key)
+        obj = obj.get_object()
+    
+    if isinstance(obj, DictionaryObject):
+        digest.update(b'<<')
+        for name in sorted(obj.keys()):
+            # /Parent leads back into the page tree, which changes as pages are added
+            if name == '/Parent':
+                continue
+            digest.update(name.encode('utf-8'))
+            _hash_object(obj.raw_get(name), digest, seen)
+        digest.update(b'>>')
+        if isinstance(obj, StreamObject):
+            # The encoded bytes are enough to tell streams apart, no need to decode
+            digest.update(obj._data)
+    elif isinstance(obj, ArrayObject):
+        digest.update(b'[')
+        for item in obj:
+            _hash_object(item, digest, seen)
+        digest.update(b']')
+    else:
+        digest.update(repr(obj).encode('utf-8'))
+
+def page_fingerprint(page):
+    """Hash of everything that determines how a page looks: contents, resources, boxes"""
+    digest = hashlib.sha256()
+    seen = set()
+    if page.indirect_reference is not None:
+        seen.add((page.indirect_reference.idnum, page.indirect_reference.generation))
+    _hash_object(page, digest, seen)
+    return digest.hexdigest()
+
+def output_groups(items, combine):
+    """Split per-source-page items into one tuple per output page"""
+    items = list(items)
+    if not combine:
+        return [(item,) for item in items]
+    return [tuple(items[i:i + 2]) for i in range(0, len(items), 2)]
+
+def load_manifest(output_path):
+    """
+    Return the manifest saved with output_path, or None if missing or unreadable
+    
+    A manifest is only valid for the exact output file it was saved with:
+    when something else has replaced the output since (an output cache hit
+    for an earlier version of the input, or a run without --incremental),
+    its pages no longer match the recorded fingerprints and None is returned.
+    """
+    try:
+        with open(manifest_path(output_path), 'r', encoding='utf-8') as file:
+            manifest = json.load(file)
+        if manifest.get('format') != MANIFEST_FORMAT:
+            return None
+        if manifest.get('output') != file_digest(output_path):
+            return None
+    except (OSError, ValueError, AttributeError):
+        return None
+    return manifest
+
+def save_manifest(output_path, options, fingerprints):
+    """Record the options and input page fingerprints an output was made from, and its hash"""
+    path = manifest_path(output_path)
+    manifest = {
+        'format': MANIFEST_FORMAT,
+        'output': file_digest(output_path),
+        'options': options,
+        'pages': fingerprints,
+    }
+    fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            json.dump(manifest, file, indent=1)
+        os.chmod(temp_path, DEFAULT_FILE_MODE)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def unchanged_output_pages(manifest, options, fingerprints):
+    """
+    Indices of output pages whose source pages match the manifest
+    
+    An output page is unchanged when it is made from the same source page
+    fingerprints as before; with combine_pages a lone last page that now
+    has a partner counts as changed.
+    """
+    if manifest is None or manifest.get('options') != options:
+        return set()
+    
+    old_pages = manifest.get('pages', [])
+    combine = options.get('combine_pages')
+    old_groups = output_groups(old_pages, combine and len(old_pages) > 1)
+    new_groups = output_groups(fingerprints, combine and len(fingerprints) > 1)
+    return {
+        index for index, (old, new) in enumerate(zip(old_groups, new_groups))
+        if old == new
+    }
@@ -5,10 +5,18 @@ Converts greenboard lecture notes to printer-friendly format
 """
 
 import argparse
+import contextlib
+import io
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from pdf_processor import PDFProcessor
-from utils import validate_input_file, validate_output_path, setup_output_directory, check_dependencies
+from utils import (
+    validate_input_file, validate_output_path, setup_output_directory, check_dependencies, parse_size,
+    is_case_insensitive
+)
+from cache import default_cache_dir
 
 def find_pdf_files(folder_path):
     """Find all PDF files in the given folder"""
@@ -26,6 +34,124 @@ def find_pdf_files(folder_path):
     
     return sorted([str(pdf) for pdf in pdf_files])
 
+def batch_output_file(input_file, output_dir):
+    """Output path for a file processed in batch mode"""
+    return output_dir / f"{Path(input_file).stem}_processed.pdf"
+
+# Per-process PDFProcessor, created once by init_worker in each pool worker
+_worker_processor = None
+
+def init_worker(processor_options):
+    """Create the PDFProcessor used by this pool worker"""
+    global _worker_processor
+    _worker_processor = PDFProcessor(**processor_options)
+
+def process_files_in_worker(files):
+    """
+    Process (input_file, output_file) pairs one after another in a pool worker
+    Returns each file's captured progress output and error message (or None)
+    """
+    results = []
+    for input_file, output_file in files:
+        log = io.StringIO()
+        error = None
+        with contextlib.redirect_stdout(log):
+            try:
+                validate_input_file(input_file)
+                _worker_processor.process_pdf(input_file, output_file)
+            except Exception as e:
+                error = str(e)
+        results.append((log.getvalue(), error))
+    return results
+
+def group_by_output_file(input_files, output_dir):
+    """
+    Indices of input_files grouped by the batch output file they write
+    
+    Where output_dir is on a case-insensitive filesystem, paths are compared
+    case-insensitively, since x.pdf and x.PDF then write the same output
+    file; elsewhere they write two. Groups and their members keep input order.
+    """
+    fold_case = is_case_insensitive(output_dir)
+    groups = {}
+    for index, input_file in enumerate(input_files):
+        key = os.path.normcase(os.path.abspath(batch_output_file(input_file, output_dir)))
+        if fold_case:
+            key = key.casefold()
+        groups.setdefault(key, []).append(index)
+    return list(groups.values())
+
+def process_batch(input_files, output_dir, processor_options, jobs=1):
+    """
+    Process several PDFs into output_dir, continuing past per-file errors
+    
+    With jobs > 1 files run in a process pool, largest first so a long
+    lecture doesn't end up alone at the tail. Each file's output is printed
+    as one block, in input order, once that file is done. Files that would
+    write the same output file are processed one after another in input
+    order, so the last one wins as in a sequential run.
+    """
+    groups = group_by_output_file(input_files, output_dir)
+    for group in groups:
+        if len(group) > 1:
+            names = ", ".join(str(input_files[index]) for index in group)
+            print(f"Warning: {names} all write {batch_output_file(input_files[group[-1]], output_dir)}; "
+                  f"the last one wins")
+    
+    if jobs <= 1:
+        processor = PDFProcessor(**processor_options)
+        for input_file in input_files:
+            try:
+                validate_input_file(input_file)
+                
+                # Generate output filename
+                output_file = batch_output_file(input_file, output_dir)
+                
+                print(f"Processing {input_file}...")
+                processor.process_pdf(input_file, str(output_file))
+                print(f"Output saved to {output_file}")
+                
+            except Exception as e:
+                print(f"Error processing {input_file}: {e}")
+                continue
+        return
+    
+    def file_size(index):
+        path = input_files[index]
+        return os.path.getsize(path) if os.path.isfile(path) else 0
+    
+    schedule = sorted(groups, key=lambda group: sum(file_size(index) for index in group), reverse=True)
+    
+    executor = ProcessPoolExecutor(
+        max_workers=jobs, initializer=init_worker, initargs=(processor_options,)
+    )
+    try:
+        # Each input's future and its position in that future's results
+        futures = {}
+        for group in schedule:
+            files = [(input_files[index], str(batch_output_file(input_files[index], output_dir)))
+                     for index in group]
+            future = executor.submit(process_files_in_worker, files)
+            for position, index in enumerate(group):
+                futures[index] = (future, position)
+        
+        for index, input_file in enumerate(input_files):
+            future, position = futures[index]
+            try:
+                log, error = future.result()[position]
+            except Exception as e:
+                # The worker itself failed (e.g. it was killed)
+                log, error = "", str(e)
+            
+            print(f"Processing {input_file}...")
+            print(log, end="")
+            if error:
+                print(f"Error processing {input_file}: {error}")
+            else:
+                print(f"Output saved to {batch_output_file(input_file, output_dir)}")
+    finally:
+        executor.shutdown(cancel_futures=True)
+
 def main():
     # Check dependencies first
     check_dependencies()
@@ -63,6 +189,164 @@ def main():
         help="DPI for image processing (default: 200)"
     )
     
+    parser.add_argument(
+        "--max-memory",
+        type=parse_size,
+        help="Memory budget for pages in flight, e.g. 512M or 2G (default: 8-page window)"
+    )
+    
+    parser.add_argument(
+        "--max-output-size",
+        type=parse_size,
+        help="Size limit for each output PDF, e.g. 20M; pages are stored at lower JPEG "
+             "quality, lower DPI or in black and white as needed to stay under it"
+    )
+    
+    parser.add_argument(
+        "--preview",
+        action="store_true",
+        help="Decide which pages to invert from a fast low-resolution preview render"
+    )
+    
+    parser.add_argument(
+        "--passthrough",
+        action="store_true",
+        help="Copy pages that need no inversion losslessly from the input PDF (implies --preview)"
+    )
+    
+    parser.add_argument(
+        "--extract-images",
+        action="store_true",
+        help="Decode single embedded screenshot images at native resolution instead of rendering pages"
+    )
+    
+    parser.add_argument(
+        "--color-mode",
+        choices=["auto", "gray", "rgb", "bilevel"],
+        default="auto",
+        help="Output color: auto keeps pages without color as grayscale, gray or rgb forces one, "
+             "bilevel makes pages black and white (default: auto)"
+    )
+    
+    parser.add_argument(
+        "--threshold",
+        choices=["global", "adaptive"],
+        default="global",
+        help="How --color-mode bilevel separates ink from background: one level per page, "
+             "or per pixel from its surroundings for uneven lighting (default: global)"
+    )
+    
+    parser.add_argument(
+        "--flatten-background",
+        action="store_true",
+        help="Make the background of inverted pages pure white, which prints cleaner and compresses better"
+    )
+    
+    parser.add_argument(
+        "--despeckle",
+        action="store_true",
+        help="Remove isolated specks such as chalk dust from inverted pages (implies --flatten-background)"
+    )
+    
+    parser.add_argument(
+        "--encoding",
+        choices=["jpeg", "flate", "auto"],
+        default="jpeg",
+        help="How page images are stored: jpeg, lossless flate, or auto to pick flate for pages "
+             "with few small pixel-to-pixel changes (little fine noise, e.g. clean text or "
+             "screenshots) and jpeg for the rest (default: jpeg)"
+    )
+    
+    parser.add_argument(
+        "--jpeg-quality",
+        type=int,
+        choices=range(1, 96),
+        metavar="1-95",
+        default=75,
+        help="JPEG quality for page images (default: 75)"
+    )
+    
+    parser.add_argument(
+        "--flate-level",
+        type=int,
+        choices=range(10),
+        metavar="0-9",
+        default=6,
+        help="Flate compression level, higher is smaller but slower (default: 6)"
+    )
+    
+    parser.add_argument(
+        "--raster-overlay",
+        action="store_true",
+        help="Draw the filename and page number into the page image instead of as vector text"
+    )
+    
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of files to process in parallel (default: 1)"
+    )
+    
+    parser.add_argument(
+        "--page-jobs",
+        type=int,
+        default=1,
+        help="Number of processes (and poppler render threads) working on the pages of each file (default: 1)"
+    )
+    
+    parser.add_argument(
+        "--threads",
+        action="store_true",
+        help="Run --page-jobs workers as threads instead of processes"
+    )
+    
+    parser.add_argument(
+        "--raster-queue",
+        type=int,
+        default=2,
+        help="Rendered pages buffered ahead of the image workers, 0 to render inline (default: 2)"
+    )
+    
+    parser.add_argument(
+        "--write-queue",
+        type=int,
+        default=2,
+        help="Processed pages buffered ahead of the PDF writer, 0 to process inline (default: 2)"
+    )
+    
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only process pages added or changed since the output was last made (keeps a .manifest.json next to it)"
+    )
+    
+    parser.add_argument(
+        "--cache-dir",
+        help=f"Directory for cached outputs of unchanged inputs (default: {default_cache_dir()})"
+    )
+    
+    parser.add_argument(
+        "--cache-size",
+        type=parse_size,
+        default="1G",
+        help="Size limit for the output cache, least recently used outputs are evicted (default: 1G)"
+    )
+    
+    parser.add_argument(
+        "--page-cache-size",
+        type=parse_size,
+        default="0",
+        help="Cache processed pages up to this size, reused when only layout or overlays change; "
+             "pages take about 12 MB each at 200 DPI (default: 0, off)"
+    )
+    
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always process inputs, without reading or writing the output and page caches"
+    )
+    
     args = parser.parse_args()
     
     # Determine if we have folder input or file input(s)
@@ -106,29 +390,40 @@ def main():
         sys.exit(1)
     
     # Process files
-    processor = PDFProcessor(quality=args.quality, combine_pages=args.combine_pages)
+    processor_options = dict(
+        quality=args.quality,
+        combine_pages=args.combine_pages,
+        max_memory=args.max_memory,
+        preview=args.preview,
+        passthrough=args.passthrough,
+        extract_images=args.extract_images,
+        page_jobs=args.page_jobs,
+        page_threads=args.threads,
+        raster_queue_depth=args.raster_queue,
+        write_queue_depth=args.write_queue,
+        cache_dir=None if args.no_cache else (args.cache_dir or default_cache_dir()),
+        cache_size=args.cache_size,
+        page_cache_size=args.page_cache_size,
+        incremental=args.incremental,
+        raster_overlay=args.raster_overlay,
+        color_mode=args.color_mode,
+        threshold=args.threshold,
+        encoding=args.encoding,
+        jpeg_quality=args.jpeg_quality,
+        flate_level=args.flate_level,
+        max_output_size=args.max_output_size,
+        flatten_background=args.flatten_background,
+        despeckle=args.despeckle
+    )
     
     try:
         if folder_input:
             # Folder batch processing
-            for input_file in pdf_files:
-                try:
-                    validate_input_file(input_file)
-                    
-                    # Generate output filename
-                    input_path = Path(input_file)
-                    output_file = output_dir / f"{input_path.stem}_processed.pdf"
-                    
-                    print(f"Processing {input_file}...")
-                    processor.process_pdf(input_file, str(output_file))
-                    print(f"Output saved to {output_file}")
-                    
-                except Exception as e:
-                    print(f"Error processing {input_file}: {e}")
-                    continue
+            process_batch(pdf_files, output_dir, processor_options, jobs=args.jobs)
                     
         elif len(args.input) == 1 and not args.output_dir:
             # Single file processing
+            processor = PDFProcessor(**processor_options)
             validate_input_file(input_file)
             validate_output_path(output_file)
             
@@ -138,21 +433,7 @@ def main():
             
         else:
             # Multiple file batch processing
-            for input_file in args.input:
-                try:
-                    validate_input_file(input_file)
-                    
-                    # Generate output filename
-                    input_path = Path(input_file)
-                    output_file = output_dir / f"{input_path.stem}_processed.pdf"
-                    
-                    print(f"Processing {input_file}...")
-                    processor.process_pdf(input_file, str(output_file))
-                    print(f"Output saved to {output_file}")
-                    
-                except Exception as e:
-                    print(f"Error processing {input_file}: {e}")
-                    continue
+            process_batch(args.input, output_dir, processor_options, jobs=args.jobs)
                     
     except KeyboardInterrupt:
         print("\nOperation cancelled by user")
@@ -0,0 +1,124 @@
+"""
+Page Buffer Module
+Passes page pixels to worker processes through shared memory slots
+"""
+
+from multiprocessing import shared_memory
+from PIL import Image
+import os
+import queue
+import shutil
+
+# Where POSIX shared memory lives on Linux; elsewhere its size can't be checked
+SHARED_MEMORY_DIR = '/dev/shm'
+
+class PageRef:
+    """A page stored in a shared memory slot: the slot index and how to rebuild it"""
+    
+    def __init__(self, slot, mode, size, length, info):
+        self.slot = slot
+        self.mode = mode
+        self.size = size
+        self.length = length
+        self.info = info
+
+class PageBuffers:
+    """
+    Views onto a set of shared memory slots, in the parent or a worker
+    
+    Pages are stored as their raw pixel bytes, so only a small PageRef
+    has to be pickled between processes.
+    """
+    
+    def __init__(self, blocks):
+        self._blocks = blocks
+        self.slot_bytes = min(block.size for block in blocks)
+    
+    @classmethod
+    def attach(cls, names):
+        """Open the slots created by a PageBufferPool in another process"""
+        return cls([shared_memory.SharedMemory(name=name) for name in names])
+    
+    def store(self, slot, image):
+        """Copy image into a slot; returns a PageRef, or None if it doesn't fit"""
+        data = image.tobytes()
+        if len(data) > self.slot_bytes:
+            return None
+        self._blocks[slot].buf[:len(data)] = data
+        return PageRef(slot, image.mode, image.size, len(data), dict(image.info))
+    
+    def load(self, ref):
+        """Rebuild a page from its slot; the image owns a copy of the pixels"""
+        image = Image.frombytes(ref.mode, ref.size, self._blocks[ref.slot].buf[:ref.length])
+        image.info.update(ref.info)
+        return image
+    
+    def close(self):
+        for block in self._blocks:
+            block.close()
+
+class PageBufferPool(PageBuffers):
+    """
+    Fixed set of shared memory slots for pages sent to a process pool
+    
+    The parent hands slots out with share() and gets them back with
+    collect() once the result page has been read out. acquire() blocks
+    while every slot is in use, which holds back the page producer.
+    """
+    
+    def __init__(self, slot_count, slot_bytes):
+        blocks = []
+        try:
+            for _ in range(slot_count):
+                blocks.append(shared_memory.SharedMemory(create=True, size=slot_bytes))
+        except Exception:
+            for block in blocks:
+                block.close()
+                block.unlink()
+            raise
+        super().__init__(blocks)
+        
+        self._free = queue.Queue()
+        for slot in range(slot_count):
+            self._free.put(slot)
+    
+    @staticmethod
+    def has_room(total_bytes):
+        """Check shared memory can hold total_bytes (a small /dev/shm would SIGBUS)"""
+        if not os.path.isdir(SHARED_MEMORY_DIR):
+            return True
+        return shutil.disk_usage(SHARED_MEMORY_DIR).free >= total_bytes
+    
+    @property
+    def names(self):
+        return [block.name for block in self._blocks]
+    
+    def acquire(self):
+        return self._free.get()
+    
+    def release(self, slot):
+        self._free.put(slot)
+    
+    def share(self, image):
+        """Move image into a free slot; returns a PageRef, or image itself if it doesn't fit"""
+        slot = self.acquire()
+        ref = self.store(slot, image)
+        if ref is None:
+            self.release(slot)
+            return image
+        return ref
+    
+    def collect(self, result, pages):
+        """Turn a worker result back into an image and free the slots of its pages"""
+        if isinstance(result, PageRef):
+            result = self.load(result)
+        for page in pages:
+            if isinstance(page, PageRef):
+                self.release(page.slot)
+        return result
+    
+    def close(self):
+        """Release the shared memory; no worker may use the slots afterwards"""
+        for block in self._blocks:
+            block.close()
+            block.unlink()
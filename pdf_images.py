@@ -0,0 +1,198 @@
+"""
+Embedded Image Module
+Finds pages that show a single embedded image and decodes it directly
+"""
+
+from PIL import Image
+from PyPDF2.generic import ArrayObject, ContentStream
+import io
+
+# Content stream operators allowed on a single-image page: graphics state,
+# transforms, rectangular clipping and the image itself
+ALLOWED_OPERATORS = {b'q', b'Q', b'cm', b're', b'W', b'W*', b'n', b'Do'}
+
+COLOR_MODES = {'/DeviceRGB': 'RGB', '/DeviceGray': 'L'}
+ICC_MODES = {3: 'RGB', 1: 'L'}
+
+class EmbeddedImage:
+    """Placement of a page's only image: its XObject and visible pixel box"""
+    
+    def __init__(self, xobject, mode, crop_box, dpi):
+        self.xobject = xobject
+        self.mode = mode
+        self.crop_box = crop_box
+        self.dpi = dpi
+    
+    def decode(self):
+        """Decode the image at its native resolution, cropped to what the page shows"""
+        width = int(self.xobject['/Width'])
+        height = int(self.xobject['/Height'])
+        data = self.xobject.get_data()
+        
+        if _filters(self.xobject) and _filters(self.xobject)[-1] == '/DCTDecode':
+            image = Image.open(io.BytesIO(data))
+            image.load()
+        else:
+            image = Image.frombytes(self.mode, (width, height), data)
+        del data
+        
+        if self.crop_box != (0, 0, width, height):
+            image = image.crop(self.crop_box)
+        
+        # Stretched placements only: make pixels square at the higher
+        # resolution so later layout steps keep the displayed aspect ratio
+        dpi_x, dpi_y = self.dpi
+        if abs(dpi_x - dpi_y) > 0.01 * max(dpi_x, dpi_y):
+            dpi = max(dpi_x, dpi_y)
+            size = (int(round(image.width * dpi / dpi_x)), int(round(image.height * dpi / dpi_y)))
+            image = image.resize(size, Image.Resampling.LANCZOS)
+            dpi_x = dpi_y = dpi
+        
+        image.info['dpi'] = (dpi_x, dpi_y)
+        return image
+
+def _filters(xobject):
+    filters = xobject.get('/Filter')
+    if filters is None:
+        return []
+    if isinstance(filters, ArrayObject):
+        return [str(f) for f in filters]
+    return [str(filters)]
+
+def _image_mode(xobject):
+    """Pillow mode for an 8-bit RGB or gray image we can decode, else None"""
+    if xobject.get('/ImageMask') or '/SMask' in xobject or '/Mask' in xobject:
+        return None
+    if '/Decode' in xobject or xobject.get('/BitsPerComponent') != 8:
+        return None
+    
+    filters = _filters(xobject)
+    if any(f not in ('/FlateDecode', '/DCTDecode') for f in filters):
+        return None
+    if '/DCTDecode' in filters[:-1]:
+        return None
+    
+    color_space = xobject.get('/ColorSpace')
+    if color_space is None:
+        return None
+    color_space = color_space.get_object()
+    if isinstance(color_space, ArrayObject):
+        if len(color_space) == 2 and color_space[0] == '/ICCBased':
+            return ICC_MODES.get(color_space[1].get_object().get('/N'))
+        return None
+    return COLOR_MODES.get(str(color_space))
+
+def _multiply(m, ctm):
+    """Concatenate a scale/translate matrix onto the CTM (PDF: m x ctm)"""
+    a, d, e, f = m
+    ca, cd, ce, cf = ctm
+    return (a * ca, d * cd, e * ca + ce, f * cd + cf)
+
+def _transform_rect(ctm, x0, y0, x1, y1):
+    a, d, e, f = ctm
+    xs = sorted((x0 * a + e, x1 * a + e))
+    ys = sorted((y0 * d + f, y1 * d + f))
+    return (xs[0], ys[0], xs[1], ys[1])
+
+def _intersect(r1, r2):
+    return (max(r1[0], r2[0]), max(r1[1], r2[1]), min(r1[2], r2[2]), min(r1[3], r2[3]))
+
+def find_embedded_image(page):
+    """
+    Detect a page whose only content is one embedded image
+    
+    The content stream may only transform, clip to rectangles and draw one
+    image XObject; any text, vector drawing, form or unsupported image
+    encoding disqualifies the page. Returns an EmbeddedImage or None.
+    """
+    if (page.get('/Rotate', 0) or 0) % 360:
+        return None
+    
+    resources = page.get('/Resources')
+    if resources is None:
+        return None
+    xobjects = resources.get_object().get('/XObject')
+    if xobjects is None:
+        return None
+    xobjects = xobjects.get_object()
+    if len(xobjects) != 1:
+        return None
+    name = list(xobjects.keys())[0]
+    xobject = xobjects[name].get_object()
+    if xobject.get('/Subtype') != '/Image':
+        return None
+    mode = _image_mode(xobject)
+    if mode is None:
+        return None
+    
+    contents = page.get_contents()
+    if contents is None:
+        return None
+    try:
+        operations = ContentStream(contents, page.pdf).operations
+    except Exception:
+        return None
+    
+    mediabox = page.mediabox
+    page_box = (float(mediabox.left), float(mediabox.bottom), float(mediabox.right), float(mediabox.top))
+    
+    # Minimal interpreter for axis-aligned transforms and clips
+    ctm, clip = (1.0, 1.0, 0.0, 0.0), page_box
+    stack = []
+    path = []
+    clip_pending = False
+    placement = None
+    for operands, operator in operations:
+        if operator not in ALLOWED_OPERATORS:
+            return None
+        if operator == b'q':
+            stack.append((ctm, clip))
+        elif operator == b'Q':
+            if not stack:
+                return None
+            ctm, clip = stack.pop()
+        elif operator == b'cm':
+            a, b, c, d, e, f = [float(v) for v in operands]
+            if b or c or a <= 0 or d <= 0:
+                return None
+            ctm = _multiply((a, d, e, f), ctm)
+        elif operator == b're':
+            x, y, w, h = [float(v) for v in operands]
+            path.append(_transform_rect(ctm, x, y, x + w, y + h))
+        elif operator in (b'W', b'W*'):
+            clip_pending = True
+        elif operator == b'n':
+            if clip_pending:
+                if len(path) != 1:
+                    return None
+                clip = _intersect(clip, path[0])
+            path = []
+            clip_pending = False
+        elif operator == b'Do':
+            if placement is not None or operands[0] != name:
+                return None
+            placement = (_transform_rect(ctm, 0, 0, 1, 1), clip)
+    
+    if placement is None:
+        return None
+    
+    image_rect, clip = placement
+    visible = _intersect(image_rect, clip)
+    if visible[2] <= visible[0] or visible[3] <= visible[1]:
+        return None
+    
+    # Map the visible area to pixels; image rows run top to bottom
+    width = int(xobject['/Width'])
+    height = int(xobject['/Height'])
+    scale_x = width / (image_rect[2] - image_rect[0])
+    scale_y = height / (image_rect[3] - image_rect[1])
+    crop_box = (
+        max(0, int(round((visible[0] - image_rect[0]) * scale_x))),
+        max(0, int(round((image_rect[3] - visible[3]) * scale_y))),
+        min(width, int(round((visible[2] - image_rect[0]) * scale_x))),
+        min(height, int(round((image_rect[3] - visible[1]) * scale_y))),
+    )
+    if crop_box[2] <= crop_box[0] or crop_box[3] <= crop_box[1]:
+        return None
+    
+    return EmbeddedImage(xobject, mode, crop_box, (scale_x * 72.0, scale_y * 72.0))
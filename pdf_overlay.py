@@ -0,0 +1,182 @@
+"""
+PDF Overlay Module
+Adds filename and page number footers to PDF pages as vector text
+"""
+
+from PyPDF2.generic import (
+    ArrayObject, DecodedStreamObject, DictionaryObject, IndirectObject, NameObject
+)
+from reportlab.pdfbase.pdfmetrics import getAscentDescent, stringWidth
+
+# Footer font; Helvetica is a standard PDF font, so nothing is embedded
+FONT_RESOURCE = '/PFHelv'
+FONT_NAME = 'Helvetica'
+# Python's name for the font's WinAnsiEncoding; it covers Western European
+# text, dashes and curly quotes, but not e.g. Greek, Cyrillic or CJK names
+FONT_ENCODING = 'cp1252'
+
+# Layout in points, matching the raster overlay at 200 DPI
+# (20 px margin, 5 px padding and line gap)
+MARGIN = 7.2
+PADDING = 1.8
+LINE_GAP = 1.8
+
+def footer_font_size(page_height):
+    """Font size that scales with the page like the raster overlay"""
+    return max(6.0, page_height * 0.015)
+
+def can_draw(text):
+    """Whether the footer font has every character of text"""
+    try:
+        text.encode(FONT_ENCODING)
+    except UnicodeEncodeError:
+        return False
+    return True
+
+def _pdf_string(text):
+    """
+    Encode text as a PDF literal string for a WinAnsi font
+    
+    Raises UnicodeEncodeError for characters the font lacks (see can_draw),
+    rather than drawing a '?' that stringWidth measured as the original.
+    """
+    data = text.encode(FONT_ENCODING)
+    data = data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+    return b'(' + data + b')'
+
+def _display_transform(width, height, rotation, origin):
+    """
+    Matrix mapping display coordinates to page space for a /Rotate value
+    
+    Returns (matrix, display_width, display_height), so the footer lands in
+    the bottom-right corner of the page as viewers show it.
+    """
+    x0, y0 = origin
+    rotation = rotation % 360
+    if rotation == 90:
+        return (0, 1, -1, 0, x0 + width, y0), height, width
+    if rotation == 180:
+        return (-1, 0, 0, -1, x0 + width, y0 + height), width, height
+    if rotation == 270:
+        return (0, -1, 1, 0, x0, y0 + height), height, width
+    return (1, 0, 0, 1, x0, y0), width, height
+
+def footer_stream(width, height, filename_text, page_text, rotation=0, origin=(0, 0)):
+    """
+    Build a content stream drawing the filename and page number footer
+    
+    Args:
+        width, height: Page (MediaBox) size in points
+        filename_text: Upper footer line; must pass can_draw
+        page_text: Lower footer line, e.g. "Page 3/12"
+        rotation: The page's /Rotate value
+        origin: Lower-left corner of the MediaBox
+    """
+    matrix, width, height = _display_transform(width, height, rotation, origin)
+    
+    font_size = footer_font_size(height)
+    ascent, descent = getAscentDescent(FONT_NAME, font_size)
+    line_height = ascent - descent
+    
+    commands = [b'q', b'%g %g %g %g %g %g cm' % matrix]
+    lines = [
+        (page_text, MARGIN),
+        (filename_text, MARGIN + line_height + 2 * PADDING + LINE_GAP),
+    ]
+    for text, bottom in lines:
+        text_width = stringWidth(text, FONT_NAME, font_size)
+        x = width - text_width - MARGIN
+        
+        # White background box behind the text for better readability
+        commands.append(b'1 g %.2f %.2f %.2f %.2f re f' % (
+            x - PADDING, bottom - PADDING, text_width + 2 * PADDING, line_height + 2 * PADDING
+        ))
+        commands.append(b'BT 0 g %s %.2f Tf %.2f %.2f Td %s Tj ET' % (
+            FONT_RESOURCE.encode(), font_size, x, bottom - descent, _pdf_string(text)
+        ))
+    commands.append(b'Q')
+    
+    return b'\n'.join(commands) + b'\n'
+
+def _font_dictionary():
+    return DictionaryObject({
+        NameObject('/Type'): NameObject('/Font'),
+        NameObject('/Subtype'): NameObject('/Type1'),
+        NameObject('/BaseFont'): NameObject('/' + FONT_NAME),
+        NameObject('/Encoding'): NameObject('/WinAnsiEncoding'),
+    })
+
+def _stream_data(reference):
+    try:
+        return reference.get_object().get_data()
+    except Exception:
+        return None
+
+def has_footer(page):
+    """Check whether a page's contents have the layout add_footer produces"""
+    contents = page.get('/Contents')
+    if contents is None:
+        return False
+    contents = contents.get_object()
+    if not isinstance(contents, ArrayObject) or len(contents) < 2:
+        return False
+    last = _stream_data(contents[-1])
+    return _stream_data(contents[0]) == b'q\n' and last is not None and last.startswith(b'\nQ\n')
+
+def remove_footer(page):
+    """Undo add_footer, leaving the page's original content streams"""
+    if not has_footer(page):
+        raise ValueError("Page has no footer added by add_footer")
+    contents = page['/Contents'].get_object()
+    page[NameObject('/Contents')] = ArrayObject(contents[1:-1])
+
+def add_footer(writer, page, filename_text, page_text):
+    """
+    Append a footer content stream to a page held by a PyPDF2 PdfWriter
+    
+    The page's existing content streams and images are left untouched; they
+    are wrapped in q/Q so their graphics state cannot leak into the footer.
+    """
+    mediabox = page.mediabox
+    stream = footer_stream(
+        float(mediabox.width),
+        float(mediabox.height),
+        filename_text,
+        page_text,
+        rotation=page.get('/Rotate', 0) or 0,
+        origin=(float(mediabox.left), float(mediabox.bottom)),
+    )
+    
+    # Register the font in the page resources
+    resources = page.get('/Resources')
+    if resources is None:
+        resources = DictionaryObject()
+        page[NameObject('/Resources')] = resources
+    resources = resources.get_object()
+    fonts = resources.get('/Font')
+    if fonts is None:
+        fonts = DictionaryObject()
+        resources[NameObject('/Font')] = fonts
+    fonts = fonts.get_object()
+    if FONT_RESOURCE not in fonts:
+        fonts[NameObject(FONT_RESOURCE)] = writer._add_object(_font_dictionary())
+    
+    def add_stream(data):
+        content = DecodedStreamObject()
+        content.set_data(data)
+        return writer._add_object(content)
+    
+    contents = page.get('/Contents')
+    existing = []
+    if contents is not None:
+        contents_object = contents.get_object()
+        if isinstance(contents_object, ArrayObject):
+            existing = list(contents_object)
+        elif isinstance(contents, IndirectObject):
+            existing = [contents]
+        else:
+            existing = [writer._add_object(contents)]
+    
+    page[NameObject('/Contents')] = ArrayObject(
+        [add_stream(b'q\n')] + existing + [add_stream(b'\nQ\n' + stream)]
+    )
@@ -3,18 +3,388 @@ PDF Processing Module
 Handles PDF-to-image conversion and image-to-PDF creation
 """
 
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 from PIL import Image
 from pathlib import Path
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+import queue
+import threading
 import tempfile
 import os
+import PyPDF2
 from image_processor import ImageProcessor
+from pdf_writer import StreamingPDFWriter
+from size_budget import SizeBudget
+from pdf_overlay import add_footer, can_draw, has_footer, remove_footer
+from pdf_images import find_embedded_image
+from utils import DEFAULT_FILE_MODE, format_size
+from page_buffers import PageBufferPool, PageBuffers, PageRef
+from cache import OutputCache, PageCache, file_digest, unlink_shared
+from incremental import (
+    load_manifest, output_groups, page_fingerprint, save_manifest, unchanged_output_pages
+)
+
+# Per-process ImageProcessor and shared page slots, set up once by
+# init_page_worker in each pool worker
+_worker_image_processor = None
+_worker_page_buffers = None
+
+def init_page_worker(image_processor, slot_names=None):
+    """Install the ImageProcessor and attach the page slots used by this page worker"""
+    global _worker_image_processor, _worker_page_buffers
+    _worker_image_processor = image_processor
+    if slot_names:
+        _worker_page_buffers = PageBuffers.attach(slot_names)
+
+def process_output_page_in_worker(images, dark_flags, filename, page_num, total_pages, combine,
+                                  page_cache=None, cache_keys=None):
+    """
+    Produce one output page in a pool worker
+    
+    Source pages may arrive as PageRefs into shared memory; the result then
+    goes back into the first page's slot when it fits.
+    """
+    refs = [image for image in images if isinstance(image, PageRef)]
+    images = [
+        _worker_page_buffers.load(image) if isinstance(image, PageRef) else image
+        for image in images
+    ]
+    
+    result = _worker_image_processor.process_output_page(
+        images, dark_flags, filename, page_num, total_pages, combine, page_cache, cache_keys
+    )
+    del images
+    
+    if refs:
+        return _worker_page_buffers.store(refs[0].slot, result) or result
+    return result
+
+def _page_pool_context():
+    """
+    Multiprocessing context for page worker pools
+    
+    The pool is started from the image stage's thread while the rasterizer
+    thread may be inside subprocess.Popen launching poppler. A forked worker
+    would inherit Popen's exec status pipe and keep it open, so Popen waits
+    forever. Workers forked from a forkserver (or spawned, where there is
+    none) don't hold any of this process's pipes. The server imports this
+    module once, so workers start with it loaded.
+    """
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload([__name__])
+    return context
+
+def _ordered_map(executor, function, argument_tuples, window):
+    """
+    Run function over argument tuples on an executor, yielding results in order
+    
+    At most `window` calls are submitted ahead of the result being waited
+    on, so a slow consumer doesn't make the inputs pile up in memory.
+    """
+    in_flight = deque()
+    for arguments in argument_tuples:
+        in_flight.append(executor.submit(function, *arguments))
+        if len(in_flight) >= window:
+            yield in_flight.popleft().result()
+    while in_flight:
+        yield in_flight.popleft().result()
+
+# Marks the end of a stage's output in its queue
+_STAGE_DONE = object()
+
+def _iter_in_thread(iterable, depth, name):
+    """
+    Run an iterator in a background thread, yielding its items through a queue
+    
+    The queue holds at most `depth` items, so the producing stage blocks
+    when the consumer falls behind. Exceptions from the producer are raised
+    in the consumer; closing this generator stops the producer. A depth of
+    0 runs the iterator inline instead.
+    """
+    if depth <= 0:
+        yield from iterable
+        return
+    
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    
+    def put(entry):
+        while not stop.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((_STAGE_DONE, None))
+        except BaseException as e:
+            put((_STAGE_DONE, e))
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+    
+    thread = threading.Thread(target=produce, name=name, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is _STAGE_DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
 
 class PDFProcessor:
-    def __init__(self, quality=200, combine_pages=False):
+    # Pages alive outside the render window: the page being inverted and
+    # its result, a buffered combine_pages pair and the A4 canvas (overlays
+    # are drawn in place)
+    PIPELINE_PAGE_OVERHEAD = 4
+    # Preview thumbnails are tiny, so render many per poppler call
+    PREVIEW_CHUNK_SIZE = 64
+    # Output pages queued per page worker, and pages each of them holds
+    # (up to two source pages plus the result)
+    PAGE_JOB_WINDOW = 2
+    PAGE_JOB_PAGES = 3
+    
+    def __init__(self, quality=200, combine_pages=False, chunk_size=8, max_memory=None,
+                 preview=False, preview_width=300, passthrough=False, extract_images=False,
+                 page_jobs=1, page_threads=False, shared_buffers=True,
+                 raster_queue_depth=2, write_queue_depth=2, cache_dir=None, cache_size=1024**3,
+                 page_cache_size=0, incremental=False, raster_overlay=False,
+                 color_mode='auto', threshold='global', encoding='jpeg', jpeg_quality=75,
+                 flate_level=6, max_output_size=None, flatten_background=False, despeckle=False):
         self.quality = quality
         self.combine_pages = combine_pages
-        self.image_processor = ImageProcessor(dpi=quality)
+        # Number of pages rendered per poppler call when iterating pages
+        self.chunk_size = max(1, chunk_size)
+        # Memory budget in bytes for in-flight pages, overrides chunk_size
+        self.max_memory = max_memory
+        # Decide inversion from a low-DPI preview instead of the full render
+        self.preview = preview
+        self.preview_width = preview_width
+        # Copy pages that need no inversion straight from the source PDF
+        self.passthrough = passthrough
+        # Decode single embedded screenshots instead of rasterizing their pages
+        self.extract_images = extract_images
+        # Worker processes for page image work, and poppler render threads
+        self.page_jobs = max(1, page_jobs)
+        # Run page workers as threads sharing this process instead of processes;
+        # Pillow releases the GIL in its pixel loops, and pages aren't pickled
+        self.page_threads = page_threads
+        # Hand pages to worker processes through shared memory, not pickles
+        self.shared_buffers = shared_buffers
+        # Pages buffered between the render, image and write stages, which
+        # run on their own threads; 0 runs a stage inline with the next
+        self.raster_queue_depth = max(0, raster_queue_depth)
+        self.write_queue_depth = max(0, write_queue_depth)
+        # Reuse earlier outputs for unchanged inputs and options
+        self.output_cache = OutputCache(cache_dir, cache_size) if cache_dir else None
+        # Reuse processed pages when only layout or overlay options changed;
+        # off unless given a size, as each page is stored uncompressed
+        # (about 12 MB for an RGB A4 page at 200 DPI)
+        self.page_cache = PageCache(cache_dir, page_cache_size) if cache_dir and page_cache_size else None
+        # Only process pages that changed since the last run into the same output
+        self.incremental = incremental
+        # Draw the filename and page number footer into the page pixels
+        # instead of as vector text on top of the page image
+        self.raster_overlay = raster_overlay
+        # 'auto' carries pages without color as grayscale, see ImageProcessor
+        self.color_mode = color_mode
+        # How color_mode 'bilevel' picks black and white, see ImageProcessor
+        self.threshold = threshold
+        # How the writer stores page images, see StreamingPDFWriter
+        self.encoding = encoding
+        self.jpeg_quality = jpeg_quality
+        self.flate_level = flate_level
+        # Byte limit for each output PDF, met by lowering quality page by page
+        self.max_output_size = max_output_size
+        # Make the former board background white, and clear specks off it
+        self.flatten_background = flatten_background or despeckle
+        self.despeckle = despeckle
+        self.image_processor = ImageProcessor(
+            dpi=quality, color_mode=color_mode, threshold=threshold,
+            flatten_background=flatten_background, despeckle=despeckle
+        )
+    
+    def estimate_page_bytes(self, pdf_path):
+        """Estimate the RGB raster size of the largest page at the current DPI"""
+        try:
+            with open(pdf_path, 'rb') as file:
+                reader = PyPDF2.PdfReader(file)
+                max_area = max(
+                    float(page.mediabox.width) * float(page.mediabox.height)
+                    for page in reader.pages
+                )
+        except Exception as e:
+            raise Exception(f"Failed to read PDF page sizes: {str(e)}")
+        
+        # Page area in square inches x DPI^2 x 3 bytes per RGB pixel
+        pixels = (max_area / (72.0 * 72.0)) * self.quality * self.quality
+        a4_pixels = self.image_processor.a4_width * self.image_processor.a4_height
+        return int(max(pixels, a4_pixels) * 3)
+    
+    def chunk_size_for(self, pdf_path):
+        """Pick the render window size for a file, honouring max_memory"""
+        if not self.max_memory:
+            # Give each poppler render thread at least one page per call
+            return max(self.chunk_size, self.page_jobs)
+        
+        page_bytes = self.estimate_page_bytes(pdf_path)
+        overhead = (self.PIPELINE_PAGE_OVERHEAD + self.pages_in_workers()
+                    + self.raster_queue_depth + self.write_queue_depth)
+        # pdf2image holds both the raw PPM output and the decoded images of
+        # a chunk while converting, so each rendered page counts twice
+        budget_pages = self.max_memory // page_bytes - overhead
+        chunk_size = budget_pages // 2
+        if chunk_size < 1:
+            print(f"Warning: --max-memory is below the ~{page_bytes * (overhead + 2) // 2**20} MB "
+                  f"needed for one page at {self.quality} DPI, rendering one page at a time")
+            return 1
+        return chunk_size
+    
+    def page_slot_bytes(self, pdf_path):
+        """Shared memory slot size for the pages of a file, or None if unknown"""
+        try:
+            page_bytes = self.estimate_page_bytes(pdf_path)
+        except Exception:
+            return None
+        # pdftoppm rounds page sizes up to whole pixels, so allow a few
+        # extra rows and columns; bigger pages fall back to pickling
+        margin_pixels = 4 * (self.image_processor.a4_width + self.image_processor.a4_height)
+        return page_bytes + margin_pixels * 3
+    
+    def pages_in_workers(self):
+        """Upper bound on page images queued for or held by page workers"""
+        if self.page_jobs <= 1:
+            return 0
+        return self.page_jobs * self.PAGE_JOB_WINDOW * self.PAGE_JOB_PAGES
+    
+    def get_page_count(self, pdf_path):
+        """Return the number of pages in the PDF"""
+        try:
+            return int(pdfinfo_from_path(pdf_path)["Pages"])
+        except Exception as e:
+            raise Exception(f"Failed to read PDF page count: {str(e)}")
+    
+    @staticmethod
+    def _page_windows(page_numbers, chunk_size):
+        """Split sorted page numbers into runs of consecutive pages, at most chunk_size long"""
+        window = []
+        for page_number in page_numbers:
+            if window and (page_number != window[-1] + 1 or len(window) == chunk_size):
+                yield window[0], window[-1]
+                window = []
+            window.append(page_number)
+        if window:
+            yield window[0], window[-1]
+    
+    def iter_pdf_images(self, pdf_path, chunk_size=None, pages=None, size=None):
+        """
+        Yield PDF pages as PIL images, rendering a window of pages at a time
+        
+        Only `chunk_size` pages are held in memory at once, so peak memory
+        depends on the window size rather than on the page count.
+        
+        Args:
+            pages: 1-based page numbers to render, in order (default: all pages)
+            size: Render to this (width, height) instead of at the DPI setting,
+                  as in pdf2image; use None for a free dimension
+        """
+        chunk_size = max(1, chunk_size or self.chunk_size)
+        if pages is None:
+            pages = range(1, self.get_page_count(pdf_path) + 1)
+        
+        for first_page, last_page in self._page_windows(pages, chunk_size):
+            try:
+                images = convert_from_path(
+                    pdf_path,
+                    dpi=self.quality,
+                    fmt='RGB',
+                    first_page=first_page,
+                    last_page=last_page,
+                    size=size,
+                    thread_count=min(self.page_jobs, last_page - first_page + 1)
+                )
+            except Exception as e:
+                raise Exception(f"Failed to convert PDF to images: {str(e)}")
+            
+            # Hand pages over one by one and drop our references as we go
+            images.reverse()
+            while images:
+                yield images.pop()
+    
+    def iter_source_pages(self, pdf_path, chunk_size=None, pages=None):
+        """
+        Yield the page images to process, in page order
+        
+        With extract_images, a page that only shows one embedded JPEG/PNG is
+        decoded at the image's native resolution instead of being rendered;
+        all other pages are rasterized with iter_pdf_images.
+        """
+        if not self.extract_images:
+            yield from self.iter_pdf_images(pdf_path, chunk_size=chunk_size, pages=pages)
+            return
+        
+        try:
+            reader = PyPDF2.PdfReader(pdf_path)
+            if pages is None:
+                pages = range(1, len(reader.pages) + 1)
+        except Exception as e:
+            raise Exception(f"Failed to read PDF: {str(e)}")
+        
+        # Consecutive pages without a usable embedded image are rendered together
+        pending = []
+        for page_number in pages:
+            try:
+                embedded = find_embedded_image(reader.pages[page_number - 1])
+            except Exception:
+                embedded = None
+            
+            if embedded is None:
+                pending.append(page_number)
+                continue
+            
+            if pending:
+                yield from self.iter_pdf_images(pdf_path, chunk_size=chunk_size, pages=pending)
+                pending = []
+            
+            try:
+                yield embedded.decode()
+            except Exception:
+                # Undecodable image data, let poppler render the page instead
+                yield from self.iter_pdf_images(pdf_path, chunk_size=chunk_size, pages=[page_number])
+        
+        if pending:
+            yield from self.iter_pdf_images(pdf_path, chunk_size=chunk_size, pages=pending)
+    
+    def preview_dark_pages(self, pdf_path, pages=None):
+        """
+        Decide which pages need inversion from a low-resolution preview render
+        
+        Pages are rendered `preview_width` pixels wide (pdftoppm scales them
+        directly) and analysed like full pages. Returns one bool per page,
+        or one bool per entry of `pages` when only those pages are wanted.
+        """
+        dark_pages = []
+        previews = self.iter_pdf_images(
+            pdf_path, chunk_size=self.PREVIEW_CHUNK_SIZE, pages=pages, size=(self.preview_width, None)
+        )
+        for preview in previews:
+            dark_pages.append(bool(self.image_processor.is_image_dark(preview)))
+        return dark_pages
     
     def pdf_to_images(self, pdf_path):
         """Convert PDF pages to PIL images"""
@@ -28,59 +398,558 @@ class PDFProcessor:
         except Exception as e:
             raise Exception(f"Failed to convert PDF to images: {str(e)}")
     
-    def images_to_pdf(self, images, output_path):
-        """Convert list of PIL images to PDF"""
-        if not images:
-            raise ValueError("No images provided for PDF creation")
+    def images_to_pdf(self, images, output_path, footer_path=None, total_pages=None):
+        """
+        Convert PIL images to PDF, writing each page as soon as it is read
         
+        With footer_path, each page gets a vector text footer naming that
+        file and numbering the page out of total_pages. With max_output_size
+        and total_pages, pages are stored at lower quality, DPI or as black
+        and white as needed to keep the PDF within that size (see SizeBudget).
+        """
+        filename_text = os.path.splitext(os.path.basename(footer_path))[0] if footer_path else None
         try:
-            # Ensure all images are in RGB mode
-            rgb_images = []
-            for img in images:
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                rgb_images.append(img)
+            with StreamingPDFWriter(output_path, resolution=self.quality, encoding=self.encoding,
+                                    jpeg_quality=self.jpeg_quality, flate_level=self.flate_level) as writer:
+                budget = None
+                if self.max_output_size and total_pages:
+                    budget = SizeBudget(self.max_output_size, total_pages, writer,
+                                        self.image_processor.binarize)
+                for page_num, img in enumerate(images, 1):
+                    footer = (filename_text, f"Page {page_num}/{total_pages}") if footer_path else None
+                    if budget is not None:
+                        budget.add_page(img, footer=footer)
+                    else:
+                        writer.add_page(img, footer=footer)
             
-            # Save as PDF
-            rgb_images[0].save(
-                output_path,
-                save_all=True,
-                append_images=rgb_images[1:] if len(rgb_images) > 1 else [],
-                format='PDF',
-                resolution=self.quality
+            for line in writer.encode_report():
+                print(f"Encoded {line}")
+            if budget is not None:
+                for line in budget.report():
+                    print(f"Size budget {line}")
+                output_size = os.path.getsize(output_path)
+                if output_size > self.max_output_size:
+                    print(f"Warning: output is {format_size(output_size)}, over the "
+                          f"{format_size(self.max_output_size)} limit")
+        except ValueError:
+            raise
+        except Exception as e:
+            raise Exception(f"Failed to create PDF from images: {str(e)}")
+    
+    def iter_inverted_pages(self, images, page_count, dark_pages=None, page_numbers=None, page_keys=None):
+        """Invert each page as it arrives from the rasterizer, caching pages listed in page_keys"""
+        if page_numbers is None:
+            page_numbers = range(1, page_count + 1)
+        
+        for page_num, image in zip(page_numbers, images):
+            print(f"Processing page {page_num}/{page_count}")
+            is_dark = dark_pages[page_num - 1] if dark_pages is not None else None
+            inverted = self.image_processor.invert_colors(image, is_dark=is_dark)
+            if page_keys and page_num in page_keys:
+                self.page_cache.store(page_keys[page_num], inverted)
+            yield inverted
+    
+    def iter_overlaid_pages(self, images, output_path, total_pages, page_numbers=None):
+        """Add filename and page number overlays as pages arrive (none if output_path is None)"""
+        if output_path is None:
+            yield from images
+            return
+        if page_numbers is None:
+            page_numbers = range(1, total_pages + 1)
+        
+        # Pages arrive here with no other owner, so draw on them directly
+        for page_num, image in zip(page_numbers, images):
+            yield self.image_processor.add_text_overlay(
+                image, output_path, page_num, total_pages, in_place=True
             )
+    
+    def iter_processed_pages(self, images, output_path, page_count, dark_pages=None,
+                             page_numbers=None, combine=False, slot_bytes=None, page_keys=None):
+        """
+        Turn source page images into finished output pages, in order
+        
+        Runs invert, combine, binarize (bilevel mode) and overlay as a
+        generator chain, or with page_jobs > 1 hands each output page's
+        sources to a worker pool (processes, or threads with page_threads)
+        and reassembles the results in page order.
+        
+        Args:
+            output_path: Output file named in the overlay, or None to leave
+                         overlays to the caller
+            page_count: Number of pages in the source PDF
+            dark_pages: Precomputed darkness decision per source page, or None
+            page_numbers: 1-based source page numbers of images (default: all)
+            slot_bytes: Size of the shared memory slots passing pages to worker
+                        processes, or None to pickle them
+            page_keys: Page cache keys of the source pages to cache once inverted
+        """
+        total_pages = (page_count + 1) // 2 if combine else page_count
+        if page_numbers is None:
+            page_numbers = range(1, page_count + 1)
+        
+        if self.page_jobs <= 1:
+            pages = self.iter_inverted_pages(images, page_count, dark_pages, page_numbers, page_keys)
+            if combine:
+                pages = self.image_processor.iter_combined_pages(pages)
+                page_numbers = None
+            if self.color_mode == 'bilevel':
+                pages = (self.image_processor.binarize(page) for page in pages)
+            yield from self.iter_overlaid_pages(pages, output_path, total_pages, page_numbers)
+            return
+        
+        if self.page_threads:
+            executor = ThreadPoolExecutor(max_workers=self.page_jobs, thread_name_prefix="page-worker")
+            function = self.image_processor.process_output_page
+            yield from self._iter_pool_results(executor, function, images, output_path, page_count,
+                                               total_pages, dark_pages, page_numbers, combine, page_keys)
+            return
+        
+        window = self.page_jobs * self.PAGE_JOB_WINDOW
+        buffers = self._page_buffer_pool(slot_bytes, window * (2 if combine else 1))
+        executor = ProcessPoolExecutor(
+            max_workers=self.page_jobs,
+            mp_context=_page_pool_context(),
+            initializer=init_page_worker,
+            initargs=(self.image_processor, buffers.names if buffers else None),
+        )
+        yield from self._iter_pool_results(executor, process_output_page_in_worker, images, output_path,
+                                           page_count, total_pages, dark_pages, page_numbers, combine,
+                                           page_keys, buffers)
+    
+    def _page_buffer_pool(self, slot_bytes, slot_count):
+        """Create shared memory slots for a process pool, or None to pickle pages"""
+        if not self.shared_buffers or not slot_bytes:
+            return None
+        
+        if not PageBufferPool.has_room(slot_bytes * slot_count):
+            print(f"Warning: not enough shared memory for {slot_count} page buffers, "
+                  f"sending pages to workers by pickling")
+            return None
+        try:
+            return PageBufferPool(slot_count, slot_bytes)
+        except Exception as e:
+            print(f"Warning: could not allocate shared page buffers ({e}), "
+                  f"sending pages to workers by pickling")
+            return None
+    
+    def _iter_pool_results(self, executor, function, images, output_path, page_count, total_pages,
+                           dark_pages, page_numbers, combine, page_keys=None, buffers=None):
+        """Run the per-output-page tasks on executor and yield the results in order"""
+        tasks = self._iter_page_tasks(images, output_path, page_count, total_pages,
+                                      dark_pages, page_numbers, combine, page_keys)
+        # Sources of the tasks submitted but not yet collected, oldest first
+        task_sources = deque()
+        
+        def share(tasks):
+            for sources, *arguments in tasks:
+                sources = [buffers.share(image) for image in sources]
+                task_sources.append(sources)
+                yield (sources, *arguments)
+        
+        try:
+            if buffers is not None:
+                tasks = share(tasks)
+            for result in _ordered_map(executor, function, tasks, self.page_jobs * self.PAGE_JOB_WINDOW):
+                if buffers is not None:
+                    result = buffers.collect(result, task_sources.popleft())
+                yield result
+        finally:
+            executor.shutdown(cancel_futures=True)
+            if buffers is not None:
+                buffers.close()
+    
+    def iter_output_pages(self, input_path, output_path, page_count, chunk_size,
+                          dark_pages=None, page_numbers=None, combine=False, input_digest=None):
+        """
+        Staged pipeline yielding finished output pages in order
+        
+        The rasterizer and the image stage each run on their own thread, and
+        the caller (the PDF writer) is the last stage. Bounded queues between
+        them (raster_queue_depth, write_queue_depth) let poppler, the pixel
+        work and JPEG encoding overlap while a slow stage holds back the rest.
+        
+        With the page cache and the input's digest, pages processed by an
+        earlier run are loaded from the cache instead of rendered and inverted.
+        """
+        slot_bytes = None
+        if self.page_jobs > 1 and not self.page_threads and self.shared_buffers:
+            slot_bytes = self.page_slot_bytes(input_path)
+        
+        page_keys = None
+        if self.page_cache is not None and input_digest is not None:
+            if page_numbers is None:
+                page_numbers = range(1, page_count + 1)
+            if dark_pages is None:
+                dark_pages = [None] * page_count
+            page_keys = {
+                page_num: self.page_cache.key(input_digest, page_num, self.page_options(dark_pages[page_num - 1]))
+                for page_num in page_numbers
+            }
+            cached = {page_num for page_num in page_numbers if self.page_cache.contains(page_keys[page_num])}
+            if cached:
+                print(f"Reusing {len(cached)} processed pages from the page cache")
+            
+            pages = self.iter_cached_source_pages(input_path, chunk_size, page_numbers, dark_pages, page_keys, cached)
+            # Cached pages are already processed, so inversion must leave them as they are
+            dark_pages = [False if page_num in cached else is_dark
+                          for page_num, is_dark in enumerate(dark_pages, 1)]
+            page_keys = {page_num: key for page_num, key in page_keys.items() if page_num not in cached}
+        else:
+            pages = self.iter_source_pages(input_path, chunk_size=chunk_size, pages=page_numbers)
+        
+        pages = _iter_in_thread(pages, self.raster_queue_depth, "rasterizer")
+        pages = self.iter_processed_pages(
+            pages, output_path, page_count, dark_pages=dark_pages, page_numbers=page_numbers,
+            combine=combine, slot_bytes=slot_bytes, page_keys=page_keys
+        )
+        return _iter_in_thread(pages, self.write_queue_depth, "image-worker")
+    
+    def page_options(self, is_dark):
+        """Settings that affect a processed page, for page cache keys"""
+        return {
+            'quality': self.quality,
+            'extract_images': self.extract_images,
+            'color_mode': self.color_mode,
+            'flatten_background': self.flatten_background,
+            'despeckle': self.despeckle,
+            # A decision made from a preview, or None when made from the page itself
+            'is_dark': is_dark,
+        }
+    
+    def iter_cached_source_pages(self, input_path, chunk_size, page_numbers, dark_pages, page_keys, cached):
+        """
+        Yield source pages in order, taking the pages in `cached` from the page cache
+        
+        Only the other pages are rendered. A cached page that has been
+        evicted in the meantime is rendered and inverted here instead.
+        """
+        rendered = self.iter_source_pages(
+            input_path, chunk_size=chunk_size,
+            pages=[page_num for page_num in page_numbers if page_num not in cached]
+        )
+        for page_num in page_numbers:
+            if page_num not in cached:
+                yield next(rendered)
+                continue
             
+            image = self.page_cache.load(page_keys[page_num])
+            if image is None:
+                image = next(self.iter_source_pages(input_path, pages=[page_num]))
+                image = self.image_processor.invert_colors(image, is_dark=dark_pages[page_num - 1])
+            yield image
+    
+    def _iter_page_tasks(self, images, output_path, page_count, total_pages, dark_pages, page_numbers,
+                         combine, page_keys=None):
+        """Group source pages into per-output-page worker arguments"""
+        page_cache = self.page_cache if page_keys else None
+        group = []
+        for page_num, image in zip(page_numbers, images):
+            print(f"Processing page {page_num}/{page_count}")
+            is_dark = dark_pages[page_num - 1] if dark_pages is not None else None
+            group.append((page_num, image, is_dark))
+            if combine and len(group) < 2 and page_num < page_count:
+                continue
+            
+            output_page_num = (group[0][0] + 1) // 2 if combine else page_num
+            sources = [image for _, image, _ in group]
+            dark_flags = [is_dark for _, _, is_dark in group]
+            cache_keys = [page_keys.get(page) if page_keys else None for page, _, _ in group]
+            group = []
+            yield (sources, dark_flags, output_path, output_page_num, total_pages, combine,
+                   page_cache, cache_keys)
+    
+    def write_passthrough_pdf(self, input_path, raster_path, dark_pages, output_path):
+        """
+        Assemble the output from source pages and processed raster pages
+        
+        Light pages are copied from the input PDF as they are (vector text,
+        fonts and original image streams) with a vector footer overlay;
+        dark pages are taken in order from the processed raster PDF, and
+        get a vector footer too unless theirs was drawn into the pixels.
+        """
+        filename_text = os.path.splitext(os.path.basename(output_path))[0]
+        total_pages = len(dark_pages)
+        
+        try:
+            reader = PyPDF2.PdfReader(input_path)
+            raster_pages = iter(PyPDF2.PdfReader(raster_path).pages) if raster_path else iter(())
+            writer = PyPDF2.PdfWriter()
+            
+            for i, (page, is_dark) in enumerate(zip(reader.pages, dark_pages)):
+                if is_dark:
+                    copied = writer.add_page(next(raster_pages))
+                    if self.raster_overlay:
+                        continue
+                else:
+                    copied = writer.add_page(page)
+                add_footer(writer, copied, filename_text, f"Page {i + 1}/{total_pages}")
+            
+            with open(output_path, 'wb') as file:
+                writer.write(file)
         except Exception as e:
-            raise Exception(f"Failed to create PDF from images: {str(e)}")
+            raise Exception(f"Failed to assemble output PDF: {str(e)}")
+    
+    def process_pdf_passthrough(self, input_path, output_path, dark_pages, chunk_size, input_digest=None):
+        """Rasterize and process only dark pages, copy light pages losslessly"""
+        page_count = len(dark_pages)
+        raster_page_numbers = [i + 1 for i, is_dark in enumerate(dark_pages) if is_dark]
+        print(f"Copying {page_count - len(raster_page_numbers)} light pages without rasterizing")
+        
+        raster_path = None
+        try:
+            if raster_page_numbers:
+                # Processed pages go to a temporary PDF next to the output
+                output_dir = os.path.dirname(os.path.abspath(output_path))
+                fd, raster_path = tempfile.mkstemp(suffix='.pdf', dir=output_dir)
+                os.close(fd)
+                
+                print(f"Converting, inverting and writing pages ({chunk_size} page window)...")
+                pages = self.iter_output_pages(
+                    input_path, output_path if self.raster_overlay else None, page_count, chunk_size,
+                    dark_pages=dark_pages, page_numbers=raster_page_numbers, input_digest=input_digest
+                )
+                self.images_to_pdf(pages, raster_path)
+            
+            self.write_passthrough_pdf(input_path, raster_path, dark_pages, output_path)
+        finally:
+            if raster_path and os.path.exists(raster_path):
+                os.remove(raster_path)
+    
+    def process_pdf_incremental(self, input_path, output_path, input_digest=None):
+        """
+        Reprocess only the pages that changed since the output was last made
+        
+        A manifest next to the output records the fingerprint of every input
+        page. Output pages whose source pages are unchanged are copied from
+        the existing output without re-encoding; the rest are processed as
+        usual. Footers are vector text (see pdf_overlay) in all pages, so
+        "Page N/M" is refreshed everywhere without re-rasterizing.
+        """
+        try:
+            reader = PyPDF2.PdfReader(input_path)
+            fingerprints = [page_fingerprint(page) for page in reader.pages]
+        except Exception as e:
+            raise Exception(f"Failed to read PDF: {str(e)}")
+        
+        page_count = len(fingerprints)
+        print(f"Found {page_count} pages")
+        
+        combine = self.combine_pages and page_count > 1
+        passthrough = self.passthrough and not combine
+        if self.passthrough and combine:
+            print("Warning: --passthrough is ignored with --combine-pages")
+        groups = output_groups(range(1, page_count + 1), combine)
+        
+        # Existing output pages to keep, if the output still matches its manifest
+        options = self.output_options(output_path)
+        del options['overlay_filename']
+        old_reader = None
+        unchanged = set()
+        manifest = load_manifest(output_path)
+        if manifest is not None and os.path.exists(output_path):
+            try:
+                old_reader = PyPDF2.PdfReader(output_path)
+                unchanged = {
+                    index for index in unchanged_output_pages(manifest, options, fingerprints)
+                    if index < len(old_reader.pages) and has_footer(old_reader.pages[index])
+                }
+            except Exception:
+                old_reader = None
+                unchanged = set()
+        
+        changed_pages = [page_num for index, group in enumerate(groups) if index not in unchanged
+                         for page_num in group]
+        print(f"{len(unchanged)} of {len(groups)} output pages unchanged, "
+              f"processing {len(changed_pages)} input pages")
+        
+        dark_pages = None
+        if changed_pages and (self.preview or passthrough):
+            print("Analysing low-resolution preview...")
+            dark_pages = [None] * page_count
+            for page_num, is_dark in zip(changed_pages, self.preview_dark_pages(input_path, changed_pages)):
+                dark_pages[page_num - 1] = is_dark
+        
+        raster_page_numbers = changed_pages
+        if passthrough:
+            raster_page_numbers = [page_num for page_num in changed_pages if dark_pages[page_num - 1]]
+        
+        output_dir = os.path.dirname(os.path.abspath(output_path))
+        raster_path = None
+        fd, temp_output_path = tempfile.mkstemp(suffix='.pdf', dir=output_dir)
+        os.close(fd)
+        try:
+            if raster_page_numbers:
+                # Changed pages are processed without raster overlays into a temporary PDF
+                fd, raster_path = tempfile.mkstemp(suffix='.pdf', dir=output_dir)
+                os.close(fd)
+                chunk_size = self.chunk_size_for(input_path)
+                print(f"Converting, inverting and writing pages ({chunk_size} page window)...")
+                pages = self.iter_output_pages(
+                    input_path, None, page_count, chunk_size, dark_pages=dark_pages,
+                    page_numbers=raster_page_numbers, combine=combine, input_digest=input_digest
+                )
+                self.images_to_pdf(pages, raster_path)
+            
+            filename_text = os.path.splitext(os.path.basename(output_path))[0]
+            try:
+                raster_pages = iter(PyPDF2.PdfReader(raster_path).pages) if raster_path else iter(())
+                writer = PyPDF2.PdfWriter()
+                for index, group in enumerate(groups):
+                    if index in unchanged:
+                        page = writer.add_page(old_reader.pages[index])
+                        remove_footer(page)
+                    elif passthrough and not dark_pages[group[0] - 1]:
+                        page = writer.add_page(reader.pages[group[0] - 1])
+                    else:
+                        page = writer.add_page(next(raster_pages))
+                    add_footer(writer, page, filename_text, f"Page {index + 1}/{len(groups)}")
+                
+                with open(temp_output_path, 'wb') as file:
+                    writer.write(file)
+            except Exception as e:
+                raise Exception(f"Failed to assemble output PDF: {str(e)}")
+            
+            os.chmod(temp_output_path, DEFAULT_FILE_MODE)
+            os.replace(temp_output_path, output_path)
+            save_manifest(output_path, options, fingerprints)
+        finally:
+            for path in (raster_path, temp_output_path):
+                if path and os.path.exists(path):
+                    os.remove(path)
+        
+        print("Processing complete!")
+    
+    def output_options(self, output_path):
+        """Every setting that affects the output PDF, for cache keys"""
+        return {
+            'quality': self.quality,
+            'combine_pages': self.combine_pages,
+            'overlay_filename': os.path.splitext(os.path.basename(output_path))[0],
+            'preview': self.preview,
+            'preview_width': self.preview_width if self.preview or self.passthrough else None,
+            'passthrough': self.passthrough,
+            'extract_images': self.extract_images,
+            'incremental': self.incremental,
+            'raster_overlay': self.raster_overlay and not self.incremental,
+            'color_mode': self.color_mode,
+            'threshold': self.threshold if self.color_mode == 'bilevel' else None,
+            'encoding': self.encoding,
+            'jpeg_quality': self.jpeg_quality if self.encoding != 'flate' else None,
+            'flate_level': self.flate_level,
+            'max_output_size': self.max_output_size,
+            'flatten_background': self.flatten_background,
+            'despeckle': self.despeckle,
+        }
     
     def process_pdf(self, input_path, output_path):
-        """Main processing function"""
-        print(f"Converting PDF to images...")
-        images = self.pdf_to_images(input_path)
-        print(f"Found {len(images)} pages")
-        
-        print("Inverting colors...")
-        processed_images = []
-        for i, image in enumerate(images):
-            print(f"Processing page {i+1}/{len(images)}")
-            inverted = self.image_processor.invert_colors(image)
-            processed_images.append(inverted)
-        
-        if self.combine_pages and len(processed_images) > 1:
-            print("Combining pages...")
-            combined_images = self.image_processor.combine_pages(processed_images)
-            processed_images = combined_images
-        
-        print("Adding text overlays...")
-        final_images = []
-        total_pages = len(processed_images)
-        for i, image in enumerate(processed_images):
-            page_num = i + 1
-            with_text = self.image_processor.add_text_overlay(
-                image, output_path, page_num, total_pages
-            )
-            final_images.append(with_text)
+        """
+        Main processing function
+        
+        With a cache directory, an input already processed with the same
+        options is served from the output cache instead of being processed
+        again, and pages processed before are taken from the page cache.
+        """
+        if self.output_cache is None:
+            self._process_pdf(input_path, output_path)
+            return
+        
+        try:
+            input_digest = file_digest(input_path)
+            key = self.output_cache.key(input_digest, self.output_options(output_path))
+            if self.output_cache.fetch(key, output_path):
+                print("Input and options unchanged, reusing cached output")
+                return
+        except OSError as e:
+            print(f"Warning: output cache unavailable ({e}), processing without it")
+            self._process_pdf(input_path, output_path)
+            return
+        
+        try:
+            self._process_pdf(input_path, output_path, input_digest)
+        finally:
+            # Pages stored before a failure count against the limit too
+            if self.page_cache is not None:
+                try:
+                    self.page_cache.evict()
+                except OSError as e:
+                    print(f"Warning: could not trim the page cache ({e})")
+        
+        try:
+            self.output_cache.store(key, output_path)
+        except OSError as e:
+            print(f"Warning: could not add output to cache ({e})")
+    
+    def _process_pdf(self, input_path, output_path, input_digest=None):
+        """
+        Process one PDF without consulting the output cache
+        
+        Pages flow through a generator pipeline (rasterize, invert, combine,
+        write with a vector footer), so only a small window of pages is in
+        memory at once. Rendering, image work and PDF writing run as
+        overlapping stages (see iter_output_pages). With page_jobs > 1 poppler
+        renders each window on several threads and the image work runs in a
+        process pool.
+        """
+        # A filename the vector footer font can't show is drawn into the
+        # pixels instead, which rules out copying whole pages that need a footer
+        raster_overlay = self.raster_overlay
+        vector_footer = can_draw(os.path.splitext(os.path.basename(output_path))[0])
+        if not vector_footer:
+            print("Warning: the output filename has characters the PDF footer font lacks, "
+                  "drawing footers into the page images")
+            raster_overlay = True
+        
+        if self.incremental and vector_footer:
+            if self.raster_overlay:
+                print("Warning: --raster-overlay is ignored with --incremental")
+            if self.max_output_size:
+                print("Warning: --max-output-size is ignored with --incremental")
+            self.process_pdf_incremental(input_path, output_path, input_digest)
+            return
+        if self.incremental:
+            print("Warning: --incremental is ignored for this file, processing every page")
+        
+        # The output is written in place from here on; an earlier cached run
+        # may have left it hardlinked to a cache entry, which must not change,
+        # even when this run doesn't use the cache. Incremental runs above
+        # replace the output file instead.
+        unlink_shared(output_path)
+        
+        page_count = self.get_page_count(input_path)
+        print(f"Found {page_count} pages")
+        
+        combine = self.combine_pages and page_count > 1
+        chunk_size = self.chunk_size_for(input_path)
+        
+        # Pass-through copies whole source pages, which can't be combined
+        passthrough = self.passthrough and not combine and vector_footer
+        if self.passthrough and combine:
+            print("Warning: --passthrough is ignored with --combine-pages")
+        elif self.passthrough and not vector_footer:
+            print("Warning: --passthrough is ignored for this file")
+        if passthrough and self.max_output_size:
+            print("Warning: --max-output-size is ignored with --passthrough")
+        
+        dark_pages = None
+        if self.preview or passthrough:
+            print("Analysing low-resolution preview...")
+            dark_pages = self.preview_dark_pages(input_path)
+            print(f"{sum(dark_pages)} of {page_count} pages need inversion")
+        
+        if passthrough:
+            self.process_pdf_passthrough(input_path, output_path, dark_pages, chunk_size, input_digest)
+            print("Processing complete!")
+            return
+        
+        print(f"Converting, inverting and writing pages ({chunk_size} page window)...")
+        # Unless footers go into the pixels, the PDF writer adds them as vector text
+        overlay_path = output_path if raster_overlay else None
+        pages = self.iter_output_pages(
+            input_path, overlay_path, page_count, chunk_size, dark_pages=dark_pages, combine=combine,
+            input_digest=input_digest
+        )
         
-        print("Creating output PDF...")
-        self.images_to_pdf(final_images, output_path)
+        total_pages = (page_count + 1) // 2 if combine else page_count
+        footer_path = None if raster_overlay else output_path
+        self.images_to_pdf(pages, output_path, footer_path=footer_path, total_pages=total_pages)
         print("Processing complete!")
\ No newline at end of file
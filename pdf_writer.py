@@ -0,0 +1,310 @@
+"""
+PDF Writer Module
+Writes images to a PDF one page at a time
+"""
+
+from PIL import Image, PdfParser, features
+from pdf_overlay import FONT_NAME, FONT_RESOURCE, footer_stream
+from utils import format_size
+import io
+import numpy as np
+import os
+import time
+import zlib
+
+def _png_image_data(png):
+    """
+    The zlib stream of a PNG file (its IDAT chunks joined), which is what a
+    PDF FlateDecode image with a PNG Predictor holds
+    """
+    position = 8  # After the PNG signature
+    chunks = []
+    while position < len(png):
+        length = int.from_bytes(png[position:position + 4], 'big')
+        if png[position + 4:position + 8] == b'IDAT':
+            chunks.append(png[position + 8:position + 8 + length])
+        position += 12 + length  # Length, type, data and CRC
+    return b''.join(chunks)
+
+class StreamingPDFWriter:
+    """
+    Append images to a PDF as they become available
+    
+    Each page's image, content stream and page object are written to disk
+    as soon as add_page is called, so the caller can drop the image right
+    away. Only object offsets and page references are kept in memory until
+    close() writes the page tree, cross-reference table and trailer.
+    
+    Footers passed to add_page are drawn as vector text over the image, so
+    they stay sharp at any print resolution and never touch the pixels.
+    
+    Pages are stored as JPEG (DCT) or losslessly with Flate and PNG row
+    predictors, or with 'auto' whichever suits each page; bilevel pages
+    always use CCITT Group 4. encode_stats records what each codec cost.
+    """
+    # Page encodings: lossy JPEG, lossless Flate, or a choice per page
+    ENCODINGS = ('jpeg', 'flate', 'auto')
+    # With 'auto', pages with little fine noise (flat screenshots, clean
+    # rendered text) go to Flate, which stores them smaller than JPEG and
+    # without artifacts; noisy pages, e.g. from JPEG-compressed sources, go
+    # to JPEG. The limit applies to noise_fraction.
+    AUTO_FLATE_NOISE = 0.05
+    
+    def __init__(self, output_path, resolution=200, encoding='jpeg', jpeg_quality=75, flate_level=6):
+        if encoding not in self.ENCODINGS:
+            raise ValueError(f"Unknown encoding: {encoding}")
+        if not 1 <= jpeg_quality <= 95:
+            raise ValueError(f"JPEG quality must be 1-95: {jpeg_quality}")
+        self.output_path = output_path
+        self.resolution = resolution
+        self.encoding = encoding
+        self.jpeg_quality = jpeg_quality
+        self.flate_level = flate_level
+        # Pages, bytes and seconds spent per codec, see encode_report
+        self.encode_stats = {}
+        self._file = open(output_path, 'wb')
+        self._pdf = PdfParser.PdfParser(f=self._file, mode='w+b')
+        self._pdf.start_writing()
+        self._pdf.write_header()
+        self._pdf.write_comment("created by print-friendly")
+        
+        # The page tree is written last, but pages need to point at it
+        self._pages_ref = self._pdf.next_object_id(0)
+        self._pdf.pages_ref = self._pages_ref
+        
+        title = os.path.splitext(os.path.basename(output_path))[0]
+        self._pdf.info["Title"] = title
+        self._pdf.info["CreationDate"] = time.gmtime()
+        self._pdf.info["ModDate"] = time.gmtime()
+        # Footer font object, written with the first footer and shared by all pages
+        self._font_ref = None
+        self.closed = False
+    
+    @property
+    def page_count(self):
+        return len(self._pdf.pages)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+    
+    def _encode_bilevel(self, image):
+        """
+        Encode a black and white (mode '1') page as a 1-bit image XObject
+        
+        Uses CCITT Group 4, the fax compression that printers and viewers
+        decode natively, or Flate where Pillow was built without libtiff.
+        """
+        image_dict = {
+            "Type": PdfParser.PdfName("XObject"),
+            "Subtype": PdfParser.PdfName("Image"),
+            "Width": image.width,
+            "Height": image.height,
+            "ColorSpace": PdfParser.PdfName("DeviceGray"),
+            "BitsPerComponent": 1,
+        }
+        
+        if not features.check('libtiff'):
+            # Packed rows of bits, 1 for white, as DeviceGray expects
+            image_dict["Filter"] = PdfParser.PdfName("FlateDecode")
+            return zlib.compress(image.tobytes(), self.flate_level), image_dict, 'ImageB', 'flate'
+        
+        # A single-strip TIFF holds one G4 stream, which is what the PDF needs
+        buffer = io.BytesIO()
+        image.save(buffer, format='TIFF', compression='group4',
+                   strip_size=(image.width + 7) // 8 * image.height)
+        with Image.open(buffer) as tiff:
+            offset = tiff.tag_v2[273][0]  # StripOffsets
+            length = tiff.tag_v2[279][0]  # StripByteCounts
+        
+        image_dict["Filter"] = PdfParser.PdfName("CCITTFaxDecode")
+        image_dict["DecodeParms"] = PdfParser.PdfDict(
+            K=-1, BlackIs1=True, Columns=image.width, Rows=image.height
+        )
+        return buffer.getvalue()[offset:offset + length], image_dict, 'ImageB', 'ccitt'
+    
+    @staticmethod
+    def noise_fraction(image, step=4, small=16):
+        """
+        Bytes per pixel that differ slightly from the same byte one pixel left
+        
+        Counted on every step-th row. Flate with PNG predictors stores flat
+        runs and clean edges well but pays for every small wobble, which is
+        what JPEG discards most cheaply; so this tells the two apart.
+        """
+        sample = image.resize((image.width, max(1, image.height // step)), Image.Resampling.NEAREST)
+        channels = len(image.getbands())
+        rows = np.asarray(sample).reshape(sample.height, -1)
+        # Wrapping uint8 arithmetic: a change of -small..small lands in 0..2*small
+        shifted = rows[:, channels:] - rows[:, :-channels] + np.uint8(small)
+        noisy = np.count_nonzero(shifted <= 2 * small) - np.count_nonzero(shifted == small)
+        return noisy / (sample.height * sample.width)
+    
+    def choose_encoding(self, image):
+        """Codec ('jpeg' or 'flate') for an RGB or grayscale page"""
+        if self.encoding != 'auto':
+            return self.encoding
+        if self.noise_fraction(image) <= self.AUTO_FLATE_NOISE:
+            return 'flate'
+        return 'jpeg'
+    
+    def _encode_image(self, image, codec=None, jpeg_quality=None):
+        """
+        Encode image as a PDF image XObject, returns (stream, dict, procset, codec)
+        
+        codec and jpeg_quality override the writer's settings for this image.
+        """
+        if image.mode == '1':
+            return self._encode_bilevel(image)
+        if image.mode == 'L':
+            # Grayscale pages keep a single channel
+            color_space = 'DeviceGray'
+            procset = 'ImageB'
+        else:
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            color_space = 'DeviceRGB'
+            procset = 'ImageC'
+        
+        image_dict = {
+            "Type": PdfParser.PdfName("XObject"),
+            "Subtype": PdfParser.PdfName("Image"),
+            "Width": image.width,
+            "Height": image.height,
+            "ColorSpace": PdfParser.PdfName(color_space),
+            "BitsPerComponent": 8,
+        }
+        buffer = io.BytesIO()
+        
+        codec = codec or self.choose_encoding(image)
+        if codec == 'flate':
+            # Pillow's PNG encoder picks a predictor for each row, which
+            # PDF readers undo with Predictor 15
+            image.save(buffer, format='PNG', compress_level=self.flate_level)
+            image_dict["Filter"] = PdfParser.PdfName("FlateDecode")
+            image_dict["DecodeParms"] = PdfParser.PdfDict(
+                Predictor=15, Colors=len(image.getbands()), BitsPerComponent=8, Columns=image.width
+            )
+            return _png_image_data(buffer.getvalue()), image_dict, procset, codec
+        
+        if jpeg_quality is None:
+            jpeg_quality = self.jpeg_quality
+        image.save(buffer, format='JPEG', quality=jpeg_quality)
+        image_dict["Filter"] = PdfParser.PdfName("DCTDecode")
+        return buffer.getvalue(), image_dict, procset, codec
+    
+    def _footer_font(self):
+        if self._font_ref is None:
+            self._font_ref = self._pdf.write_obj(
+                None,
+                Type=PdfParser.PdfName("Font"),
+                Subtype=PdfParser.PdfName("Type1"),
+                BaseFont=PdfParser.PdfName(FONT_NAME),
+                Encoding=PdfParser.PdfName("WinAnsiEncoding"),
+            )
+        return self._font_ref
+    
+    @property
+    def bytes_written(self):
+        """Size of the PDF so far, before the page tree and xref table"""
+        return self._file.tell()
+    
+    def encoded_size(self, image, codec=None, jpeg_quality=None):
+        """Bytes image would take as a page's XObject, without writing it"""
+        return len(self._encode_image(image, codec, jpeg_quality)[0])
+    
+    def encode_report(self):
+        """One line per codec used: pages, bytes produced and encode time"""
+        return [
+            f"{codec}: {pages} pages, {format_size(size)} in {seconds:.2f} s"
+            for codec, (pages, size, seconds) in sorted(self.encode_stats.items())
+        ]
+    
+    def add_page(self, image, footer=None, codec=None, jpeg_quality=None):
+        """
+        Encode image and append it to the PDF as a new page
+        
+        Args:
+            image: Page image
+            footer: Optional (filename_text, page_text) drawn in the
+                    bottom-right corner as vector text
+            codec: 'jpeg' or 'flate' for this page instead of the
+                   writer's encoding; ignored for bilevel pages
+            jpeg_quality: JPEG quality for this page
+        """
+        if self.closed:
+            raise ValueError("Cannot add pages to a closed PDF writer")
+        
+        started = time.perf_counter()
+        stream, image_dict, procset, codec = self._encode_image(image, codec, jpeg_quality)
+        pages, size, seconds = self.encode_stats.get(codec, (0, 0, 0.0))
+        self.encode_stats[codec] = (pages + 1, size + len(stream), seconds + time.perf_counter() - started)
+        image_ref = self._pdf.write_obj(None, stream=stream, **image_dict)
+        del stream
+        
+        # Page size in points from the pixel size at the output resolution,
+        # unless the image carries its own (e.g. a natively decoded screenshot)
+        x_resolution, y_resolution = image.info.get('dpi', (self.resolution, self.resolution))
+        width = image.width * 72.0 / x_resolution
+        height = image.height * 72.0 / y_resolution
+        
+        contents = b"q %f 0 0 %f 0 0 cm /image Do Q\n" % (width, height)
+        resources = dict(
+            ProcSet=[PdfParser.PdfName("PDF"), PdfParser.PdfName(procset)],
+            XObject=PdfParser.PdfDict(image=image_ref),
+        )
+        if footer is not None:
+            filename_text, page_text = footer
+            contents += footer_stream(width, height, filename_text, page_text)
+            resources['ProcSet'].append(PdfParser.PdfName("Text"))
+            resources['Font'] = PdfParser.PdfDict({FONT_RESOURCE[1:]: self._footer_font()})
+        contents_ref = self._pdf.write_obj(None, stream=contents)
+        
+        page_ref = self._pdf.write_page(
+            None,
+            Resources=PdfParser.PdfDict(**resources),
+            MediaBox=[0, 0, width, height],
+            Contents=contents_ref,
+        )
+        self._pdf.pages.append(page_ref)
+    
+    def close(self):
+        """Write the page tree, xref table and trailer and close the file"""
+        if self.closed:
+            return
+        if not self._pdf.pages:
+            self.abort()
+            raise ValueError("No images provided for PDF creation")
+        
+        self._pdf.write_obj(
+            self._pages_ref,
+            Type=PdfParser.PdfName("Pages"),
+            Count=len(self._pdf.pages),
+            Kids=self._pdf.pages,
+        )
+        self._pdf.root_ref = self._pdf.write_obj(
+            None,
+            Type=PdfParser.PdfName("Catalog"),
+            Pages=self._pages_ref,
+        )
+        self._pdf.write_xref_and_trailer()
+        self._file.flush()
+        self._pdf.close()
+        self._file.close()
+        self.closed = True
+    
+    def abort(self):
+        """Close and remove the unfinished PDF"""
+        if self.closed:
+            return
+        self._pdf.close()
+        self._file.close()
+        self.closed = True
+        if os.path.exists(self.output_path):
+            os.remove(self.output_path)
@@ -0,0 +1,212 @@
+"""
+Size Budget Module
+Picks per-page encoder settings that keep an output PDF under a byte limit
+"""
+
+from PIL import Image
+
+class PageSetting:
+    """How one page is stored: DPI scale, and codec with its JPEG quality or 'bilevel'"""
+    
+    def __init__(self, scale, codec, jpeg_quality=None):
+        self.scale = scale
+        self.codec = codec
+        self.jpeg_quality = jpeg_quality
+    
+    @property
+    def label(self):
+        name = self.codec
+        if self.jpeg_quality is not None:
+            name += f" quality {self.jpeg_quality}"
+        if self.scale != 1:
+            name += f" at {self.scale:.0%} DPI"
+        return name
+
+class SizeBudget:
+    """
+    Spreads a byte limit for an output PDF over its pages as they are written
+    
+    Each page gets a share of the bytes left, in proportion to its size at
+    the writer's own settings against the average page so far, and is
+    stored with the first setting from a ladder that fits: the writer's own
+    encoding, lower JPEG qualities, then lower DPI, and bilevel conversion
+    as a last resort.
+    Sizes are estimated from trial encodes of a sample of rows spread down
+    the page, scaled by how far estimates were off on the pages so far.
+    """
+    # Row bands making up the trial sample, about a fifth of a page; the
+    # estimates come within a few percent of the real size
+    SAMPLE_BANDS = 16
+    SAMPLE_BAND_ROWS = 32
+    # Share of each page's bytes held back for estimates that come out low
+    HEADROOM = 0.08
+    # Rungs of the ladder after the writer's own encoding
+    JPEG_QUALITIES = (60, 45, 30)
+    SCALES = (1.0, 0.75, 0.5)
+    # Kept back for the page tree, cross-reference table and trailer
+    TRAILER_BYTES = 1024
+    TRAILER_BYTES_PER_PAGE = 80
+    # Page and footer objects around each image, until measured
+    PAGE_OVERHEAD = 1024
+    
+    def __init__(self, max_bytes, total_pages, writer, binarize):
+        """
+        Args:
+            max_bytes: Limit for the finished PDF
+            total_pages: Pages that will be written
+            writer: StreamingPDFWriter the pages go to
+            binarize: Turns a page into mode '1', e.g. ImageProcessor.binarize
+        """
+        self.max_bytes = max_bytes
+        self.writer = writer
+        self.binarize = binarize
+        self._pages_left = total_pages
+        self._reserve = self.TRAILER_BYTES + self.TRAILER_BYTES_PER_PAGE * total_pages
+        # Actual and estimated image bytes of the pages written so far, their
+        # estimates at the writer's own settings, and the bytes of everything
+        # else written with them
+        self._actual = 0
+        self._estimated = 0
+        self._demand = 0
+        self._overhead = 0
+        self._pages_done = 0
+        # Pages written with each setting, by label
+        self.settings_used = {}
+    
+    def ladder(self, image):
+        """
+        Settings to try for a page, best looking first
+        
+        Settings come in groups whose sizes only go down along the group,
+        so a group can be skipped when its last setting is too big.
+        """
+        if image.mode == '1':
+            return [[PageSetting(scale, 'bilevel') for scale in self.SCALES]]
+        
+        codec = self.writer.choose_encoding(image)
+        groups = [] if codec == 'jpeg' else [[PageSetting(1.0, codec)]]
+        quality = self.writer.jpeg_quality
+        qualities = [quality] + [q for q in self.JPEG_QUALITIES if q < quality]
+        groups += [[PageSetting(scale, 'jpeg', q) for q in qualities] for scale in self.SCALES]
+        groups.append([PageSetting(scale, 'bilevel') for scale in (1.0, self.SCALES[-1])])
+        return groups
+    
+    def sample(self, image):
+        """A few bands of rows spread down the page, and how many times taller the page is"""
+        rows = self.SAMPLE_BANDS * self.SAMPLE_BAND_ROWS
+        if image.height <= rows:
+            return image, 1.0
+        
+        sample = Image.new(image.mode, (image.width, rows))
+        step = image.height // self.SAMPLE_BANDS
+        for band in range(self.SAMPLE_BANDS):
+            top = band * step + (step - self.SAMPLE_BAND_ROWS) // 2
+            sample.paste(image.crop((0, top, image.width, top + self.SAMPLE_BAND_ROWS)),
+                         (0, band * self.SAMPLE_BAND_ROWS))
+        return sample, image.height / rows
+    
+    def apply(self, image, setting):
+        """The page image to write for a setting"""
+        if setting.scale != 1:
+            dpi = image.info.get('dpi', (self.writer.resolution, self.writer.resolution))
+            if image.mode == '1':
+                image = image.convert('L')
+            size = (max(1, round(image.width * setting.scale)), max(1, round(image.height * setting.scale)))
+            image = image.resize(size, Image.Resampling.LANCZOS)
+            image.info['dpi'] = (dpi[0] * setting.scale, dpi[1] * setting.scale)
+        if setting.codec == 'bilevel' and image.mode != '1':
+            dpi = image.info.get('dpi')
+            image = self.binarize(image)
+            if dpi:
+                image.info['dpi'] = dpi
+        return image
+    
+    @property
+    def correction(self):
+        """Ratio of actual to estimated image bytes on the pages written so far"""
+        return self._actual / self._estimated if self._estimated else 1.0
+    
+    @property
+    def page_overhead(self):
+        if not self._pages_done:
+            return self.PAGE_OVERHEAD
+        return self._overhead / self._pages_done
+    
+    def share(self, demand):
+        """Image bytes for a page that would take demand bytes at the writer's own settings"""
+        available = (self.max_bytes - self._reserve - self.writer.bytes_written
+                     - self.page_overhead * self._pages_left)
+        average = self._demand / self._pages_done if self._pages_done else demand
+        others = average * max(0, self._pages_left - 1)
+        return available * demand / max(1, demand + others)
+    
+    def choose(self, image):
+        """
+        Pick the setting for a page
+        
+        Returns the first setting whose estimate fits the page's share, its
+        estimate, and the estimate at the writer's own settings.
+        """
+        if self._pages_left > 1:
+            sample, factor = self.sample(image)
+            headroom, correction = self.HEADROOM, self.correction
+        else:
+            # No later page can make up for a low estimate on the last one,
+            # so it is trial-encoded whole
+            sample, factor, headroom, correction = image, 1.0, 0.0, 1.0
+        # Sample scaled (and binarized) once for all settings that share it
+        trials = {}
+        
+        def trial_size(setting):
+            key = (setting.scale, setting.codec == 'bilevel')
+            if key not in trials:
+                trials[key] = self.apply(sample, setting)
+            codec = None if setting.codec == 'bilevel' else setting.codec
+            return self.writer.encoded_size(trials[key], codec, setting.jpeg_quality) * factor
+        
+        groups = self.ladder(image)
+        demand = trial_size(groups[0][0])
+        limit = self.share(demand) * (1 - headroom) / correction
+        
+        for group in groups:
+            estimate = demand if group is groups[0] else trial_size(group[0])
+            if estimate <= limit:
+                return group[0], estimate, demand
+            if len(group) == 1:
+                continue
+            last_estimate = trial_size(group[-1])
+            if last_estimate > limit:
+                continue
+            for setting in group[1:-1]:
+                estimate = trial_size(setting)
+                if estimate <= limit:
+                    return setting, estimate, demand
+            return group[-1], last_estimate, demand
+        # Nothing fits; the last and smallest setting leaves the most for later pages
+        return group[-1], last_estimate, demand
+    
+    def _image_bytes(self):
+        return sum(size for _, size, _ in self.writer.encode_stats.values())
+    
+    def add_page(self, image, footer=None):
+        """Write a page with the best setting that keeps the PDF within budget"""
+        setting, estimate, demand = self.choose(image)
+        image = self.apply(image, setting)
+        
+        start = self.writer.bytes_written
+        start_image = self._image_bytes()
+        codec = None if setting.codec == 'bilevel' else setting.codec
+        self.writer.add_page(image, footer=footer, codec=codec, jpeg_quality=setting.jpeg_quality)
+        
+        image_bytes = self._image_bytes() - start_image
+        self._estimated += estimate
+        self._demand += demand
+        self._actual += image_bytes
+        self._overhead += self.writer.bytes_written - start - image_bytes
+        self._pages_done += 1
+        self._pages_left -= 1
+        self.settings_used[setting.label] = self.settings_used.get(setting.label, 0) + 1
+    
+    def report(self):
+        """One line per setting used, with its page count"""
+        return [f"{label}: {pages} pages" for label, pages in self.settings_used.items()]
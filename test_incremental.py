@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Tests for incremental processing and the manifest kept next to its output
+"""
+
+import shutil
+import pytest
+import PyPDF2
+from pathlib import Path
+from incremental import load_manifest, save_manifest
+
+EXAMPLE = Path(__file__).parent / 'examples' / 'lecture_1.pdf'
+
+def write_pages(path, page_indices):
+    """Write a PDF made of the given pages of the example lecture"""
+    reader = PyPDF2.PdfReader(str(EXAMPLE))
+    writer = PyPDF2.PdfWriter()
+    for index in page_indices:
+        writer.add_page(reader.pages[index])
+    with open(path, 'wb') as file:
+        writer.write(file)
+
+def page_images(path):
+    """Encoded image data of every page, to compare outputs without rendering"""
+    images = []
+    for page in PyPDF2.PdfReader(str(path)).pages:
+        xobjects = page['/Resources']['/XObject']
+        images.append([xobjects[name].get_object()._data for name in sorted(xobjects)])
+    return images
+
+def test_manifest_rejected_when_output_replaced(tmp_path):
+    """A manifest only describes the exact output file it was saved with"""
+    output_path = str(tmp_path / 'out.pdf')
+    write_pages(output_path, [0, 1])
+    save_manifest(output_path, {'quality': 200}, ['a', 'b'])
+    assert load_manifest(output_path)['pages'] == ['a', 'b']
+    
+    # As when an output cache hit or a non-incremental run replaces the output
+    write_pages(output_path, [0])
+    assert load_manifest(output_path) is None
+
+@pytest.mark.skipif(shutil.which('pdftoppm') is None, reason="needs poppler to render pages")
+def test_incremental_after_cached_revert(tmp_path):
+    """
+    Reverting the input to an earlier version brings back its cached output;
+    the next incremental run must not copy pages from the newer manifest
+    """
+    from pdf_processor import PDFProcessor
+    
+    A, B, B2, C, D = 0, 1, 2, 3, 4
+    input_path = str(tmp_path / 'lecture.pdf')
+    output_path = str(tmp_path / 'lecture_processed.pdf')
+    cache_dir = str(tmp_path / 'cache')
+    
+    def run(page_indices, output_path=output_path, cache_dir=cache_dir):
+        write_pages(input_path, page_indices)
+        processor = PDFProcessor(quality=50, incremental=True, cache_dir=cache_dir)
+        processor.process_pdf(input_path, output_path)
+    
+    run([A, B])
+    run([A, B2, C])
+    run([A, B])  # Served from the output cache
+    run([A, B2, C, D])
+    
+    fresh_path = str(tmp_path / 'fresh' / 'lecture_processed.pdf')
+    Path(fresh_path).parent.mkdir()
+    run([A, B2, C, D], output_path=fresh_path, cache_dir=None)
+    assert page_images(output_path) == page_images(fresh_path)
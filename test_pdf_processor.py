@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Tests for the page pipeline of PDFProcessor
+"""
+
+import shutil
+import subprocess
+import sys
+import pytest
+import PyPDF2
+from pathlib import Path
+
+REPO = Path(__file__).parent
+EXAMPLE = REPO / 'examples' / 'lecture_2.pdf'
+
+@pytest.mark.skipif(shutil.which('pdftoppm') is None, reason="needs poppler to render pages")
+def test_page_jobs_with_one_page_window_finish(tmp_path):
+    """
+    Page worker processes start while the rasterizer thread launches poppler;
+    with a one-page render window that used to hang now and then
+    """
+    output_path = tmp_path / 'out.pdf'
+    command = [
+        sys.executable, str(REPO / 'main.py'), str(EXAMPLE), '-o', str(output_path),
+        '--quality', '60', '--no-cache', '--max-memory', '1M', '--page-jobs', '3',
+    ]
+    for _ in range(8):
+        try:
+            subprocess.run(command, cwd=REPO, check=True, timeout=120,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except subprocess.TimeoutExpired:
+            pytest.fail("processing with --page-jobs and a one-page window hung")
+        assert len(PyPDF2.PdfReader(str(output_path)).pages) == 13
+
+@pytest.mark.skipif(shutil.which('pdftoppm') is None, reason="needs poppler to render pages")
+def test_uncached_run_leaves_cached_output_alone(tmp_path):
+    """
+    A cache hit hardlinks the output to its cache entry; a later run without
+    the cache must replace the output, not rewrite the entry through the link
+    """
+    from pdf_processor import PDFProcessor
+    
+    output_path = str(tmp_path / 'out.pdf')
+    cache_dir = str(tmp_path / 'cache')
+    
+    def run(**options):
+        PDFProcessor(quality=50, **options).process_pdf(str(EXAMPLE), output_path)
+        return len(PyPDF2.PdfReader(output_path).pages)
+    
+    assert run(cache_dir=cache_dir) == 13
+    assert run(cache_dir=cache_dir) == 13  # Served from the cache as a hardlink
+    assert run(combine_pages=True) == 7
+    assert run(cache_dir=cache_dir) == 13
@@ -5,9 +5,19 @@ File validation, error handling, and helper operations
 
 import os
 import sys
+import tempfile
 from pathlib import Path
 import PyPDF2
 
+def _default_file_mode():
+    """Permissions a plain open() would give a new file under the current umask"""
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+# Read once at import, before any worker threads exist (os.umask is process-wide)
+DEFAULT_FILE_MODE = _default_file_mode()
+
 def validate_input_file(file_path):
     """
     Validate that input file exists and is a valid PDF
@@ -63,12 +73,34 @@ def setup_output_directory(output_dir):
     if not os.access(output_dir, os.W_OK):
         raise PermissionError(f"No write permission for directory: {output_dir}")
 
+def is_case_insensitive(directory):
+    """
+    Check whether names in directory that differ only in case name the same file
+    
+    Probes with a temporary file, so it answers for the filesystem actually
+    mounted there; False if the directory can't be written to.
+    """
+    try:
+        fd, probe_path = tempfile.mkstemp(prefix='.case-probe-', dir=directory)
+    except OSError:
+        return False
+    os.close(fd)
+    try:
+        probe_name = os.path.basename(probe_path)
+        return os.path.exists(os.path.join(directory, probe_name.swapcase()))
+    finally:
+        os.remove(probe_path)
+
 def get_file_size(file_path):
     """
     Get file size in human-readable format
     """
-    size_bytes = os.path.getsize(file_path)
-    
+    return format_size(os.path.getsize(file_path))
+
+def format_size(size_bytes):
+    """
+    Format a byte count in human-readable form, e.g. '1.5 MB'
+    """
     if size_bytes < 1024:
         return f"{size_bytes} B"
     elif size_bytes < 1024**2:
@@ -78,6 +110,29 @@ def get_file_size(file_path):
     else:
         return f"{size_bytes/(1024**3):.1f} GB"
 
+def parse_size(size_text):
+    """
+    Parse a human-readable size such as '512M', '2G' or '1048576' into bytes
+    """
+    units = {'': 1, 'B': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+    
+    text = str(size_text).strip().upper()
+    if text.endswith('IB'):
+        text = text[:-2]
+    elif text.endswith('B') and len(text) > 1 and text[-2] in 'KMGT':
+        text = text[:-1]
+    
+    number = text.rstrip('BKMGT')
+    unit = text[len(number):]
+    try:
+        value = float(number)
+    except ValueError:
+        raise ValueError(f"Invalid size: {size_text}")
+    if unit not in units or value < 0:
+        raise ValueError(f"Invalid size: {size_text}")
+    
+    return int(value * units[unit])
+
 def print_processing_summary(input_files, output_files, errors=None):
     """
     Print summary of processing results